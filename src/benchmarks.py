@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import numpy as np
+import torch
+
+from diffusion import GaussianDiffusion
+from unet import UNet
+from embedding import EmbeddingGAF
+
+# Benchmarks of the hot paths on synthetic inputs (no datasets needed). Every
+# benchmark is timed per batch size and thread count, the results are written
+# as JSON and compared against a stored baseline, slower than the baseline by
+# more than `tolerance` is flagged as a regression.
+
+# registry: name -> setup(ctx, batch_size) returning the callable to time
+BENCHMARKS = {}
+
+
+def register_benchmark(name, batched=True):
+    # batched=False: per-signal call, timed once (batch size 1)
+    def wrapper(fn):
+        fn.batched = batched
+        BENCHMARKS[name] = fn
+        return fn
+    return wrapper
+
+
+def synthetic_ecg(num_signals, length=128, fs=128, seed=0):
+    # Periodic P-QRS-T gaussians with jittered heart rate plus a little noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(length) / fs
+    signals = np.empty((num_signals, length))
+    waves = [(-0.2, 0.025, 0.15), (-0.03, 0.01, -0.1), (0., 0.008, 1.), (0.03, 0.01, -0.25), (0.25, 0.04, 0.3)]
+    for k in range(num_signals):
+        period = 60. / rng.uniform(55, 100)
+        phase = (t + rng.uniform(0, period)) % period - period / 2
+        signals[k] = sum(a * np.exp(-(phase - mu) ** 2 / (2 * sigma ** 2)) for mu, sigma, a in waves)
+        signals[k] += 0.02 * rng.standard_normal(length)
+    return signals
+
+
+class BenchmarkContext:
+    # Models and inputs shared by all benchmarks (random weights, same architecture as the trained models)
+    def __init__(self, image_size=128, sampling_steps=10, seed=0):
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        self.image_size = image_size
+        self.sampling_steps = sampling_steps
+        self.unet = UNet(in_channel=2, out_channel=1, inner_channel=32, norm_groups=32, channel_mults=(1, 2, 4, 8, 8),
+                         attn_res=[8], res_blocks=3, dropout=0, with_noise_level_emb=True, image_size=image_size)
+        config_diff = {'beta_start': 1e-6, 'beta_end': 1e-2, 'num_steps': 2000, 'schedule': "linear"}
+        self.diffusion = GaussianDiffusion(self.unet, image_size=(image_size, image_size), channels=1,
+                                           loss_type='l1', conditional=True, config_diff=config_diff)
+        self.optimizer = torch.optim.Adam(self.diffusion.parameters(), lr=1e-4)
+        self.embedding_gaf = EmbeddingGAF()
+        self.seed = seed
+        self.nstdb_tempdir = None
+
+    def nstdb_workdir(self):
+        # Synthetic NSTDB-like 'em' record (30 min, 2 channels, 360 Hz) at the path the
+        # noise builder reads, written once and shared by all thread counts
+        if self.nstdb_tempdir is None:
+            import wfdb
+            self.nstdb_tempdir = tempfile.TemporaryDirectory(prefix='bench_nstdb_')
+            record_dir = os.path.join(self.nstdb_tempdir.name, 'data', 'nstdb')
+            os.makedirs(record_dir)
+            rng = np.random.default_rng(self.seed)
+            wfdb.wrsamp('em', fs=360, units=['mV', 'mV'], sig_name=['noise1', 'noise2'],
+                        p_signal=rng.standard_normal((360 * 60 * 30, 2)), fmt=['16', '16'], write_dir=record_dir)
+        return self.nstdb_tempdir.name
+
+    def close(self):
+        # Removes the synthetic record and its noise bank cache
+        if self.nstdb_tempdir is not None:
+            self.nstdb_tempdir.cleanup()
+            self.nstdb_tempdir = None
+
+    def signals(self, batch_size):
+        return synthetic_ecg(batch_size, self.image_size, seed=self.seed)
+
+    def gaf(self, batch_size):
+        return self.embedding_gaf.ecg_to_GAF_batch(self.signals(batch_size))
+
+
+@register_benchmark('unet_forward')
+def bench_unet_forward(ctx, batch_size):
+    x = torch.cat([ctx.gaf(batch_size), torch.randn(batch_size, 1, ctx.image_size, ctx.image_size)], dim=1)
+    noise_level = torch.rand(batch_size, 1)
+    ctx.unet.eval()
+
+    def run():
+        with torch.no_grad():
+            ctx.unet(x, noise_level)
+    return run
+
+
+@register_benchmark('p_sample')
+def bench_p_sample(ctx, batch_size):
+    condition = ctx.gaf(batch_size)
+    img = torch.randn_like(condition)
+    ctx.diffusion.eval()
+    return lambda: ctx.diffusion.p_sample(img, 1000, condition_x=condition)
+
+
+@register_benchmark('p_sample_loop')
+def bench_p_sample_loop(ctx, batch_size):
+    condition = ctx.gaf(batch_size)
+    ctx.diffusion.eval()
+    return lambda: ctx.diffusion.p_sample_loop_batched(condition, sampling_steps=ctx.sampling_steps)
+
+
+@register_benchmark('ecg_to_GAF', batched=False)
+def bench_ecg_to_gaf(ctx, batch_size):
+    signal = ctx.signals(1)[0]
+    return lambda: ctx.embedding_gaf.ecg_to_GAF(signal)
+
+
+@register_benchmark('ecg_to_GAF_batch')
+def bench_ecg_to_gaf_batch(ctx, batch_size):
+    signals = ctx.signals(batch_size)
+    return lambda: ctx.embedding_gaf.ecg_to_GAF_batch(signals)
+
+
+@register_benchmark('GAF_to_ecg', batched=False)
+def bench_gaf_to_ecg(ctx, batch_size):
+    gaf = ctx.gaf(1)[0]
+    return lambda: ctx.embedding_gaf.GAF_to_ecg(gaf)
+
+
+@register_benchmark('ecg_to_GGM', batched=False)
+def bench_ecg_to_ggm(ctx, batch_size):
+    from embedding import EmbeddingGGM      # needs pyts
+    embedding_ggm = EmbeddingGGM()
+    signal = ctx.signals(1)[0]
+    return lambda: embedding_ggm.ecg_to_GGM(signal)
+
+
+@register_benchmark('add_noise_to_ecg', batched=False)
+def bench_add_noise_to_ecg(ctx, batch_size):
+    from noisy_ecg_builder import NoisyECGBuilder
+
+    workdir = ctx.nstdb_workdir()
+    builder = NoisyECGBuilder()
+    signal = ctx.signals(1)[0]
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            builder.add_noise_to_ecg(signal, noise_type='em', snr=10)
+        finally:
+            os.chdir(cwd)
+    return run
+
+
+@register_benchmark('p_losses_train_step')
+def bench_train_step(ctx, batch_size):
+    clean = ctx.gaf(batch_size)
+    noisy = ctx.embedding_gaf.ecg_to_GAF_batch(ctx.signals(batch_size) + 0.1 * np.random.randn(batch_size, ctx.image_size))
+    ctx.diffusion.train()
+
+    def run():
+        ctx.optimizer.zero_grad()
+        loss = ctx.diffusion({'HR': clean, 'SR': noisy})
+        loss.backward()
+        ctx.optimizer.step()
+    return run
+
+
+def time_fn(fn, repeats=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {'median': float(np.median(times)), 'mean': float(times.mean()), 'min': float(times.min()),
+            'repeats': repeats}
+
+
+def run_benchmarks(names=None, batch_sizes=(1, 8), thread_counts=(1, None), repeats=5, ctx=None):
+    # thread count None -> torch default (all cores). Returns {'meta': ..., 'results': {key: timing}}
+    # A context created here is closed at the end, a given one is left to the caller
+    own_ctx = ctx is None
+    ctx = ctx or BenchmarkContext()
+    default_threads = torch.get_num_threads()
+    results = {}
+    try:
+        for name in names or BENCHMARKS:
+            bench = BENCHMARKS[name]
+            for threads in thread_counts:
+                torch.set_num_threads(threads or default_threads)
+                for batch_size in (batch_sizes if bench.batched else (1,)):
+                    key = f'{name}[bs={batch_size},threads={threads or default_threads}]'
+                    try:
+                        results[key] = time_fn(bench(ctx, batch_size), repeats=repeats)
+                    except ImportError as e:
+                        results[key] = {'skipped': str(e)}      # optional dependency missing
+                    print(key, results[key])
+    finally:
+        torch.set_num_threads(default_threads)
+        if own_ctx:
+            ctx.close()
+
+    meta = {'torch': torch.__version__, 'python': platform.python_version(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'sampling_steps': ctx.sampling_steps, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare(results, baseline, tolerance=0.2):
+    # Median time against the baseline per key, ratio > 1 + tolerance is a regression
+    regressions = []
+    for key, timing in results['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None or 'median' not in timing or 'median' not in reference:
+            continue
+        ratio = timing['median'] / reference['median']
+        flag = 'REGRESSION' if ratio > 1 + tolerance else ('faster' if ratio < 1 - tolerance else 'ok')
+        print(f"{key:55s} {reference['median']*1e3:10.2f} ms -> {timing['median']*1e3:10.2f} ms  x{ratio:.2f}  {flag}")
+        if flag == 'REGRESSION':
+            regressions.append(key)
+    return regressions
+
+
+if __name__ == '__main__':
+    # CONFIG
+    benchmarks = None                   # None -> all, or a list of names from BENCHMARKS
+    batch_sizes = (1, 8)
+    thread_counts = (1, None)           # None -> all cores
+    repeats = 5
+    tolerance = 0.2                     # allowed slowdown against the baseline
+    results_path = 'benchmark_results.json'
+    baseline_path = 'benchmark_baseline.json'
+    update_baseline = False             # store this run as the new baseline
+
+    results = run_benchmarks(benchmarks, batch_sizes, thread_counts, repeats)
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Saved as:', results_path)
+
+    if update_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline saved as:', baseline_path)
+    else:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, tolerance)
+        if regressions:
+            print(len(regressions), 'regression(s) against', baseline_path)
+            sys.exit(1)
+        print('No regressions against', baseline_path)
@@ -0,0 +1,29 @@
+import pickle
+
+from gaf_shards import GAFShardWriter
+
+# Embed the training slices once and write them as memory-mapped GAF shards,
+# training.py reads them with use_gaf_shards = True
+
+# SOURCE SLICES AND OUTPUT DIRECTORY, one directory per dataset:
+#   training.py:           'ardb_slices_clean.pkl', 'ardb_slices_noisy.pkl' -> 'gaf_shards'
+#   training_continue.py:  'ardb_slices_clean_MA.pkl', 'ardb_slices_noisy_MA_snr3.pkl' -> 'gaf_shards_MA'
+path_clean = 'ardb_slices_clean.pkl'
+path_noisy = 'ardb_slices_noisy.pkl'
+out_dir = 'gaf_shards'
+
+# SLICES
+with open(path_clean, 'rb') as f:
+    clean_signals = pickle.load(f)
+
+with open(path_noisy, 'rb') as f:
+    noisy_signals = pickle.load(f)
+
+# Same 55000 training slices as the subset loop in training.py
+num_signals = 55000
+subset_size = 2500
+
+writer = GAFShardWriter(out_dir, shard_size=subset_size, window_size=128)
+index = writer.write(clean_signals[:num_signals], noisy_signals[:num_signals], source=(path_clean, path_noisy))
+
+print('Status: Written', index['length'], 'GAF pairs in', len(index['shards']), 'shards')
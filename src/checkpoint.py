@@ -0,0 +1,141 @@
+import os
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+# Checkpoints are snapshotted (detached CPU copies, not references to the live
+# tensors) and written by a background thread: torch.save to a temporary file,
+# then an atomic rename. Only the last keep_last files of every group are kept.
+# Retention only counts the files of this job: the list is part of training_state()
+# and restored by restore_written() on resume, files of other runs are never touched.
+class CheckpointManager:
+    def __init__(self, directory='.', keep_last=3):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.written = {}           # group -> paths, oldest first (kept by the caller's thread)
+        self.error = None
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def snapshot(self, module_or_state):
+        state = module_or_state.state_dict() if isinstance(module_or_state, torch.nn.Module) else module_or_state
+        return {k: v.detach().to('cpu', copy=True) if torch.is_tensor(v) else v for k, v in state.items()}
+
+    def copy_state(self, obj):
+        # Detached CPU copy of nested state (e.g. optimizer moments, updated in place)
+        if torch.is_tensor(obj):
+            return obj.detach().to('cpu', copy=True)
+        if isinstance(obj, dict):
+            return {k: self.copy_state(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.copy_state(v) for v in obj)
+        return obj
+
+    # ********************************
+    # Resumable training state
+    def capture_rng_state(self):
+        return {
+            'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+        }
+
+    def restore_rng_state(self, state):
+        random.setstate(state['python'])
+        np.random.set_state(state['numpy'])
+        torch.set_rng_state(state['torch'])
+        if state['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['cuda'])
+
+    def training_state(self, model, optimizer, scaler=None, **progress):
+        # model, optimizer moments, grad scaler and RNG states + progress (subset offset, epoch, best loss, ...)
+        state = {
+            'model': self.snapshot(model),
+            'optimizer': self.copy_state(optimizer.state_dict()),
+            'scaler': scaler.state_dict() if scaler is not None else None,
+            'rng': self.capture_rng_state(),
+            'written': {group: list(paths) for group, paths in self.written.items()}
+        }
+        state.update(progress)
+        return state
+
+    def restore_written(self, state):
+        # Retention list of the interrupted job, its older checkpoints are pruned as well
+        self.written = {group: list(paths) for group, paths in state.get('written', {}).items()}
+
+    def load_training_state(self, path):
+        if not os.path.exists(path):
+            return None
+        return torch.load(path, map_location='cpu', weights_only=False)
+
+    def clear_training_state(self, path):
+        # Once the job has finished (after close()), so the next launch starts fresh
+        # instead of resuming after the last epoch with nothing left to train
+        self.wait()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def sub_state_dict(self, state, prefix='denoise_fn.'):
+        # e.g. the UNet weights inside a GaussianDiffusion state_dict
+        return {k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)}
+
+    def save_async(self, state, filename, group=None):
+        self.raise_error()
+        path = os.path.join(self.directory, filename)
+        self.queue.put((state, path, self.retain(path, group)))
+
+    def retain(self, path, group):
+        # Retention is decided here (caller's thread, so training_state() sees a
+        # consistent list), the worker removes the returned paths after writing path
+        if group is None:
+            return []
+        paths = self.written.setdefault(group, [])
+        if path in paths:
+            paths.remove(path)
+        paths.append(path)
+        if self.keep_last is None:
+            return []
+        num_stale = max(len(paths) - self.keep_last, 0)
+        stale, paths[:] = paths[:num_stale], paths[num_stale:]
+        return stale
+
+    def run(self):
+        while True:
+            state, path, stale = self.queue.get()
+            try:
+                if state is None:
+                    return
+                self.write(state, path, stale)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, state, path, stale=()):
+        tmp_path = path + '.tmp'
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+
+        # Retention
+        for old_path in stale:
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def wait(self):
+        # Block until every queued checkpoint is on disk
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        self.wait()
+        self.queue.put((None, None, None))
+        self.worker.join()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing checkpoint failed') from error
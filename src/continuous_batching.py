@@ -0,0 +1,85 @@
+import collections
+import torch
+
+# Continuous batching of the conditional reverse process: every running sample
+# carries its own position in the timestep schedule, one step() advances all of
+# them with a single UNet forward (per-sample t). New conditions join the batch
+# at the next step, finished samples leave it, so the batch stays full under
+# steady load and a late arrival never waits for a whole trajectory.
+class ContinuousBatchScheduler:
+    def __init__(self, diffusion, max_batch_size=32, sampler='ddpm', sampling_steps=None):
+        self.diffusion = diffusion
+        self.max_batch_size = max_batch_size
+        self.sampler = sampler
+        self.device = diffusion.betas.device
+
+        timesteps = diffusion.sampling_timesteps(sampling_steps)
+        self.num_steps = len(timesteps)
+        self.schedule = torch.tensor(timesteps + [-1], dtype=torch.long, device=self.device)
+
+        self.waiting = collections.deque()      # (id, condition) not started yet
+        self.ids = []                           # running samples, row order of the tensors below
+        self.img = None
+        self.condition = None
+        self.step_idx = None                    # position in the schedule per running sample
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.ids) + len(self.waiting)
+
+    def idle(self):
+        return len(self) == 0
+
+    def add(self, condition_x):
+        # (B, C, ...) conditions -> their ids, reported again by step() when finished
+        ids = []
+        for condition in condition_x:
+            ids.append(self.next_id)
+            self.waiting.append((self.next_id, condition))
+            self.next_id += 1
+        return ids
+
+    def admit(self):
+        free = self.max_batch_size - len(self.ids)
+        new = [self.waiting.popleft() for _ in range(min(free, len(self.waiting)))]
+        if not new:
+            return
+        condition = torch.stack([c for _, c in new]).to(device=self.device, dtype=torch.float32)
+        img = torch.randn_like(condition)
+        step_idx = torch.zeros(len(new), dtype=torch.long, device=self.device)
+        if self.ids:
+            self.img = torch.cat([self.img, img])
+            self.condition = torch.cat([self.condition, condition])
+            self.step_idx = torch.cat([self.step_idx, step_idx])
+        else:
+            self.img, self.condition, self.step_idx = img, condition, step_idx
+        self.ids += [i for i, _ in new]
+
+    @torch.no_grad()
+    def step(self):
+        # One reverse step of every running sample at its own timestep.
+        # Returns [(id, sample)] of the samples that finished with this step
+        self.admit()
+        if not self.ids:
+            return []
+
+        t = self.schedule[self.step_idx]
+        t_prev = self.schedule[self.step_idx + 1]
+        self.img = self.diffusion.sampler_step(self.sampler, self.img, t, t_prev, condition_x=self.condition)
+        self.step_idx += 1
+
+        done = self.step_idx == self.num_steps
+        if not done.any():
+            return []
+        finished = [(self.ids[row], self.img[row]) for row in done.nonzero().squeeze(1).tolist()]
+        keep = ~done
+        self.img, self.condition, self.step_idx = self.img[keep], self.condition[keep], self.step_idx[keep]
+        self.ids = [i for i, d in zip(self.ids, done.tolist()) if not d]
+        return finished
+
+    def run(self):
+        # Step until everything added so far is finished -> {id: sample}
+        results = {}
+        while not self.idle():
+            results.update(self.step())
+        return results
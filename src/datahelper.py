@@ -1,5 +1,9 @@
 import os
+import pickle
+import numpy as np
 import scipy.io
+import torch
+from torch.utils.data import Dataset
 
 class DataHelper:
     def __init__(self) -> None:
@@ -51,3 +55,40 @@ class DataHelper:
         return signals_HR, signals_SR
 
 
+# Training slices (clean/noisy pickles) loaded once and kept as two (N, window)
+# float32 arrays; subsets are views, items are zero-copy tensors
+class ECGSliceDataset(Dataset):
+    def __init__(self, path_clean, path_noisy, window_size=128, start=0, stop=None):
+        self.clean_signals = self.load_slices(path_clean, window_size)
+        self.noisy_signals = self.load_slices(path_noisy, window_size)
+        if len(self.clean_signals) != len(self.noisy_signals):
+            raise ValueError("clean and noisy slices must have the same length")
+        self.start = start
+        self.stop = len(self.clean_signals) if stop is None else min(stop, len(self.clean_signals))
+
+    def load_slices(self, path, window_size):
+        with open(path, 'rb') as f:
+            slices = pickle.load(f)
+        return np.stack([np.asarray(sig[:window_size], dtype=np.float32) for sig in slices])
+
+    def subset(self, start, stop):
+        # Same arrays, different window (no reload)
+        subset = ECGSliceDataset.__new__(ECGSliceDataset)
+        subset.clean_signals = self.clean_signals
+        subset.noisy_signals = self.noisy_signals
+        subset.start = self.start + start
+        subset.stop = min(self.start + stop, self.stop)
+        return subset
+
+    def arrays(self):
+        return self.clean_signals[self.start:self.stop], self.noisy_signals[self.start:self.stop]
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        index += self.start
+        return torch.from_numpy(self.clean_signals[index]), torch.from_numpy(self.noisy_signals[index])
+
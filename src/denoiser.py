@@ -0,0 +1,129 @@
+import copy
+import time
+import numpy as np
+import torch
+
+from diffusion import GaussianDiffusion
+from unet import UNet
+from unet1d import UNet1D
+from embedding import EmbeddingGAF, EmbeddingSignal
+
+# Configuration of the trained models (same as inference.py / training.py)
+DEFAULT_CONFIG = {
+    'representation': 'gaf',            # 'gaf' (2D UNet) or 'signal' (1D UNet)
+    'signal_length': 128,
+    'unet': {
+        'in_channel': 1*2,
+        'out_channel': 1,
+        'inner_channel': 32,
+        'norm_groups': 32,
+        'channel_mults': (1, 2, 4, 8, 8),
+        'attn_res': [8],
+        'res_blocks': 3,
+        'dropout': 0,
+        'with_noise_level_emb': True
+    },
+    'diffusion': {
+        'beta_start': 1e-6,
+        'beta_end': 1e-2,
+        'num_steps': 2000,
+        'schedule': "linear"
+    }
+}
+
+
+# Importable denoiser: builds the model and loads the checkpoints once, every
+# denoise() call reuses the warm model. Timings (seconds) are kept in self.timings:
+#   'load'           cold start (model build, checkpoint load, noise cache, warm-up)
+#   'last_call'      last denoise() call end to end
+#   'last_sampling'  reverse diffusion part of it, the rest is per-call overhead
+class Denoiser:
+    def __init__(self, dn_model_path='models/dn_model_1.pth', diff_model_path='models/diff_model_1.pth',
+                 config=None, device='cpu', sampler='ddpm', max_batch_size=32, noise_cache=True, warmup=True):
+        start = time.perf_counter()
+        # merged key by key, nested dicts ('unet', 'diffusion') included
+        self.config = copy.deepcopy(DEFAULT_CONFIG)
+        for key, value in copy.deepcopy(config or {}).items():
+            if isinstance(value, dict) and isinstance(self.config.get(key), dict):
+                self.config[key].update(value)
+            else:
+                self.config[key] = value
+        self.representation = self.config['representation']
+        self.signal_length = self.config['signal_length']
+        self.device = torch.device(device)
+        self.sampler = sampler
+        self.max_batch_size = max_batch_size
+
+        if self.representation == 'gaf':
+            self.embedding = EmbeddingGAF()
+        elif self.representation == 'signal':
+            self.embedding = EmbeddingSignal()
+        else:
+            raise NotImplementedError()
+
+        self.diffusion = self.load_model(dn_model_path, diff_model_path)
+        if noise_cache:
+            self.diffusion.build_noise_cache()
+        if warmup:
+            self.warmup()
+        self.timings = {'load': time.perf_counter() - start, 'last_call': None, 'last_sampling': None}
+
+    def load_model(self, dn_model_path, diff_model_path):
+        if self.representation == 'gaf':
+            denoise_fn = UNet(image_size=self.signal_length, **self.config['unet'])
+        else:
+            denoise_fn = UNet1D(signal_length=self.signal_length, **self.config['unet'])
+        denoise_fn.load_state_dict(torch.load(dn_model_path, map_location=self.device))
+
+        diffusion = GaussianDiffusion(denoise_fn, image_size=(self.signal_length, self.signal_length), channels=1,
+                                      loss_type='l1', conditional=True, config_diff=self.config['diffusion'])
+        diffusion.load_state_dict(torch.load(diff_model_path, map_location=self.device))
+        return diffusion.to(self.device).eval()
+
+    @torch.no_grad()
+    def warmup(self):
+        # One UNet forward, so thread pools and allocations are set up before the first call
+        x = self.embed(np.zeros((1, self.signal_length), dtype=np.float32))[0]
+        self.diffusion.predict_noise(x, 0, condition_x=x)
+
+    def embed(self, signals):
+        if self.representation == 'gaf':
+            return self.embedding.ecg_to_GAF_batch(signals, device=self.device, return_scale=True)
+        return self.embedding.ecg_to_signal_batch(signals, device=self.device, return_scale=True)
+
+    def recover(self, samples, scale):
+        if self.representation == 'gaf':
+            return self.embedding.GAF_to_ecg_batch(samples, scale)
+        return self.embedding.signal_to_ecg_batch(samples, scale)
+
+    def denoise(self, signals, steps=None, shots=1, return_shots=False, **sampling):
+        # signals: (N,) or (B, N) windows of signal_length samples, records of other
+        # lengths go through sliding_window.SlidingWindowDenoiser(denoiser.diffusion).
+        # steps: reverse steps (None -> full schedule), shots: samples per signal.
+        # sampling: further p_sample_loop_batched options (adaptive, start_t).
+        # Returns (B, N), the mean over shots, or (B, shots, N) with return_shots=True
+        start = time.perf_counter()
+        signals = np.asarray(signals, dtype=np.float32)
+        single = signals.ndim == 1
+        signals = np.atleast_2d(signals)
+        if signals.shape[1] != self.signal_length:
+            raise ValueError(f"Expected windows of {self.signal_length} samples, got {signals.shape[1]}")
+
+        x, (min_, max_) = self.embed(signals)
+        x = x.repeat_interleave(shots, dim=0)
+        scale = (min_.repeat_interleave(shots, dim=0), max_.repeat_interleave(shots, dim=0))
+        # one start timestep per signal -> one per run (signal i, shot j)
+        start_t = sampling.get('start_t')
+        if start_t is not None and not isinstance(start_t, str):
+            sampling['start_t'] = torch.as_tensor(start_t).reshape(-1).expand(len(signals)).repeat_interleave(shots)
+
+        start_sampling = time.perf_counter()
+        samples = self.diffusion.p_sample_loop_batched(x, max_batch_size=self.max_batch_size, sampler=self.sampler,
+                                                       sampling_steps=steps, **sampling)
+        self.timings['last_sampling'] = time.perf_counter() - start_sampling
+
+        denoised = self.recover(samples, scale).cpu().numpy().reshape(len(signals), shots, -1)
+        if not return_shots:
+            denoised = denoised.mean(axis=1)
+        self.timings['last_call'] = time.perf_counter() - start
+        return denoised[0] if single else denoised
@@ -1,11 +1,16 @@
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
-from pyts.image import MarkovTransitionField, GramianAngularField
+
+# matplotlib and pyts are imported where they are used, the batched GAF path needs neither
 
 class EmbeddingGGM:
     def __init__(self):
-        pass
+        from pyts.image import MarkovTransitionField, GramianAngularField
+
+        # Reused across calls (stateless transformers)
+        self.gasf = GramianAngularField(method='summation')
+        self.gadf = GramianAngularField(method='difference')
+        self.mtf = MarkovTransitionField()
 
     def ecg_to_GGM(self, x):
         if isinstance(x, np.ndarray):
@@ -17,12 +22,9 @@ class EmbeddingGGM:
             x = x_np[:128]
             x = np.array([x])
                 
-        gasf = GramianAngularField(method='summation')
-        x_gasf = gasf.transform(x)
-        gadf = GramianAngularField(method='difference')
-        x_gadf = gadf.transform(x)
-        mtf = MarkovTransitionField()
-        x_mtf = mtf.transform(x)
+        x_gasf = self.gasf.transform(x)
+        x_gadf = self.gadf.transform(x)
+        x_mtf = self.mtf.transform(x)
         x_ggm = np.concatenate((x_gasf, x_gadf, x_mtf))
 
         # Convert numpy array to a PyTorch tensor
@@ -38,6 +40,42 @@ class EmbeddingGGM:
 
         return x_ggm_tensor
 
+    def ecg_to_GGM_batch(self, X, device=None, n_bins=5):
+        # (B, N) windows -> (B, 3, N, N) [GASF, GADF, MTF] in one pass, same
+        # definitions as pyts (min/max scaling, quantile bins, row-normalized transitions)
+        X = torch.as_tensor(X, dtype=torch.float32, device=device)
+        if X.dim() == 1:
+            X = X.unsqueeze(0)
+        batch, N = X.shape
+
+        # GASF / GADF
+        min_ = X.amin(dim=1, keepdim=True)
+        max_ = X.amax(dim=1, keepdim=True)
+        X_cos = ((2 * X - max_ - min_) / (max_ - min_).clamp(min=1e-12)).clamp(-1, 1)
+        X_sin = (1 - X_cos ** 2).clamp(min=0).sqrt()
+        x_gasf = X_cos.unsqueeze(2) * X_cos.unsqueeze(1) - X_sin.unsqueeze(2) * X_sin.unsqueeze(1)
+        x_gadf = X_sin.unsqueeze(2) * X_cos.unsqueeze(1) - X_cos.unsqueeze(2) * X_sin.unsqueeze(1)
+
+        # MTF: quantile bins per window
+        quantiles = torch.linspace(0, 1, n_bins + 1, device=X.device)[1:-1]
+        edges = torch.quantile(X, quantiles, dim=1).T.contiguous()             # (B, n_bins-1)
+        binned = torch.searchsorted(edges, X.contiguous(), right=True)          # (B, N)
+
+        # Transition counts bin[t] -> bin[t+1], normalized per row
+        transitions = binned[:, :-1] * n_bins + binned[:, 1:]
+        counts = torch.zeros(batch, n_bins * n_bins, device=X.device)
+        counts.scatter_add_(1, transitions, torch.ones_like(transitions, dtype=counts.dtype))
+        counts = counts.view(batch, n_bins, n_bins)
+        row_sums = counts.sum(dim=2, keepdim=True)
+        row_sums[row_sums == 0] = 1
+        transition_matrix = counts / row_sums
+
+        # MTF[b, i, j] = M[b, bin_i, bin_j]
+        rows = torch.gather(transition_matrix, 1, binned.unsqueeze(2).expand(batch, N, n_bins))
+        x_mtf = torch.gather(rows, 2, binned.unsqueeze(1).expand(batch, N, N))
+
+        return torch.stack((x_gasf, x_gadf, x_mtf), dim=1)
+
 # Further Reading: 
 #       https://medium.com/analytics-vidhya/encoding-time-series-as-images-b043becbdbf3
 class EmbeddingGAF:
@@ -85,7 +123,40 @@ class EmbeddingGAF:
 
         return diagonals
 
+    # Batched (torch) versions, stay on the device of the input
+    def ecg_to_GAF_batch(self, X, device=None, return_scale=False):
+        # (B, N) signals -> (B, 1, N, N) GASF fields
+        X = torch.as_tensor(X, dtype=torch.float32, device=device)
+        if X.dim() == 1:
+            X = X.unsqueeze(0)
+
+        # Rescale (per signal), a constant signal maps to 0 instead of NaN
+        min_ = X.amin(dim=1, keepdim=True)
+        max_ = X.amax(dim=1, keepdim=True)
+        X = ((2 * X - max_ - min_) / (max_ - min_).clamp(min=1e-12)).clamp(-1, 1)
+
+        # cos((phi_i + phi_j) / 2) with cos(phi / 2) = sqrt((1 + x) / 2), sin(phi / 2) = sqrt((1 - x) / 2)
+        cos_half = ((1 + X) / 2).sqrt()
+        sin_half = ((1 - X) / 2).sqrt()
+        GASF = cos_half.unsqueeze(2) * cos_half.unsqueeze(1) - sin_half.unsqueeze(2) * sin_half.unsqueeze(1)
+
+        if return_scale:
+            return GASF.unsqueeze(1), (min_, max_)
+        return GASF.unsqueeze(1)
+
+    def GAF_to_ecg_batch(self, gaf, scale=None):
+        # (B, 1, N, N) or (B, N, N) fields -> (B, N) diagonals,
+        # scale = (min_, max_) from ecg_to_GAF_batch restores the amplitude
+        if gaf.dim() == 4:
+            gaf = gaf[:, 0]
+        diagonals = torch.diagonal(gaf, dim1=-2, dim2=-1)
+        if scale is not None:
+            min_, max_ = scale
+            diagonals = (diagonals * (max_ - min_) + max_ + min_) / 2
+        return diagonals
+
     def visualize_tensor(self,tensor):
+        import matplotlib.pyplot as plt
         
         print('Shape', tensor.shape)
 
@@ -101,6 +172,8 @@ class EmbeddingGAF:
         plt.show()
 
     def plot_multiple_timeseries(signals, names):
+        import matplotlib.pyplot as plt
+
         num_signals = len(signals)
         
         plt.figure(figsize=(5 * num_signals, 4))
@@ -113,4 +186,32 @@ class EmbeddingGAF:
             plt.ylabel('Amplitude')
 
         plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+# Identity embedding for the 1D UNet: the rescaled waveform itself
+class EmbeddingSignal:
+    def __init__(self):
+        pass
+
+    def ecg_to_signal_batch(self, X, device=None, return_scale=False):
+        # (B, N) signals -> (B, 1, N) in [-1, 1], same rescale as ecg_to_GAF_batch
+        X = torch.as_tensor(X, dtype=torch.float32, device=device)
+        if X.dim() == 1:
+            X = X.unsqueeze(0)
+
+        min_ = X.amin(dim=1, keepdim=True)
+        max_ = X.amax(dim=1, keepdim=True)
+        X = ((2 * X - max_ - min_) / (max_ - min_).clamp(min=1e-12)).clamp(-1, 1)
+
+        if return_scale:
+            return X.unsqueeze(1), (min_, max_)
+        return X.unsqueeze(1)
+
+    def signal_to_ecg_batch(self, x, scale=None):
+        # (B, 1, N) or (B, N) -> (B, N), scale = (min_, max_) restores the amplitude
+        if x.dim() == 3:
+            x = x[:, 0]
+        if scale is not None:
+            min_, max_ = scale
+            x = (x * (max_ - min_) + max_ + min_) / 2
+        return x
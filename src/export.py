@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+
+from unet import TraceableUNet
+
+# Export of the denoising step UNet(x, noise_level) with a dynamic batch axis,
+# and backends that let GaussianDiffusion sample against the exported graph
+class UNetExporter:
+    def __init__(self):
+        pass
+
+    @torch.no_grad()
+    def export_torchscript(self, unet, path, example_inputs):
+        model = TraceableUNet(unet).eval()
+        traced = torch.jit.trace(model, example_inputs, check_trace=False)
+        traced = torch.jit.freeze(traced)
+        torch.jit.save(traced, path)
+        return traced
+
+    @torch.no_grad()
+    def export_onnx(self, unet, path, example_inputs, opset_version=17):
+        model = TraceableUNet(unet).eval()
+        torch.onnx.export(
+            model, example_inputs, path,
+            input_names=['x', 'noise_level'],
+            output_names=['noise'],
+            dynamic_axes={'x': {0: 'batch'}, 'noise_level': {0: 'batch'}, 'noise': {0: 'batch'}},
+            opset_version=opset_version
+        )
+
+    @torch.no_grad()
+    def max_abs_error(self, unet, backend, inputs):
+        # Eager vs exported output on the same inputs
+        expected = unet.eval()(*inputs)
+        actual = backend(*inputs)
+        return (expected - actual.to(expected.device)).abs().max().item()
+
+
+class TorchScriptBackend:
+    def __init__(self, path, device='cpu'):
+        self.module = torch.jit.load(path, map_location=device).eval()
+
+    @torch.no_grad()
+    def __call__(self, x, noise_level):
+        return self.module(x, noise_level)
+
+
+class OnnxRuntimeBackend:
+    def __init__(self, path, num_threads=None):
+        # optional dependency, only needed for this backend
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, x, noise_level):
+        noise = self.session.run(['noise'], {
+            'x': x.detach().cpu().numpy().astype(np.float32),
+            'noise_level': noise_level.detach().cpu().numpy().astype(np.float32)
+        })[0]
+        return torch.from_numpy(noise).to(x.device)
@@ -0,0 +1,105 @@
+import time
+import torch
+import numpy as np
+
+from diffusion import GaussianDiffusion
+from unet import UNet
+from embedding import EmbeddingGAF
+from datahelper import DataHelper
+from export import UNetExporter, TorchScriptBackend, OnnxRuntimeBackend
+
+# Export the denoising UNet to TorchScript and ONNX, check both against the
+# eager model and sample once with every backend
+
+#################################
+# AUX METHODS
+embedding_gaf = EmbeddingGAF()
+dl = DataHelper()
+
+#################################
+# CONFIGURE AND LOAD MODEL
+device = 'cpu'
+
+# Parameters of the U-Net (denoising function)
+in_channels = 1*2
+out_channels = 1                        # Output will also be GrayScale
+inner_channels = 32                     # Depth feature maps, model complexity
+norm_groups = 32                        # Granularity of normalization, impacting convergence
+channel_mults = (1, 2, 4, 8, 8)
+attn_res = [8]
+res_blocks = 3
+dropout = 0
+with_noise_level_emb = True
+image_size = 128
+
+denoise_fun = UNet(
+    in_channel=in_channels,
+    out_channel=out_channels,
+    inner_channel=inner_channels,
+    norm_groups=norm_groups,
+    channel_mults=channel_mults,
+    attn_res=attn_res,
+    res_blocks=res_blocks,
+    dropout=dropout,
+    with_noise_level_emb=with_noise_level_emb,
+    image_size=128
+).to(device)
+
+config_diff = {
+    'beta_start': 1e-6,
+    'beta_end': 1e-2,
+    'num_steps': 2000,
+    'schedule': "linear"
+}
+
+denoise_fun.load_state_dict(torch.load('models/dn_model_1.pth', map_location=device))
+denoise_fun.eval()
+diffusion = GaussianDiffusion(denoise_fun, image_size=(128,128),channels=1,loss_type='l1',conditional=True,config_diff=config_diff).to(device)
+diffusion.load_state_dict(torch.load('models/diff_model_1.pth', map_location=device))
+
+print('Status: Diffusion and denoising model loaded successfully')
+
+path_torchscript = 'models/dn_model_1.pt'
+path_onnx = 'models/dn_model_1.onnx'
+tolerance = 1e-3
+
+#################################
+# EXPORT
+exporter = UNetExporter()
+example_inputs = (torch.randn(2, in_channels, image_size, image_size), torch.rand(2, 1))
+
+exporter.export_torchscript(denoise_fun, path_torchscript, example_inputs)
+exporter.export_onnx(denoise_fun, path_onnx, example_inputs)
+
+print('Saved as:', path_torchscript, path_onnx)
+
+backends = {
+    'torchscript': TorchScriptBackend(path_torchscript, device=device),
+    'onnxruntime': OnnxRuntimeBackend(path_onnx)
+}
+
+#################################
+# NUMERICAL CHECK (other batch sizes than the export, dynamic axis)
+for batch in (1, 5):
+    inputs = (torch.randn(batch, in_channels, image_size, image_size), torch.rand(batch, 1))
+    for name, backend in backends.items():
+        error = exporter.max_abs_error(denoise_fun, backend, inputs)
+        status = 'OK' if error < tolerance else 'MISMATCH'
+        print(f'{name} batch {batch}: max abs error {error:.2e} {status}')
+
+#################################
+# SAMPLE WITH EVERY BACKEND (deterministic DDIM, same initial noise)
+signals_HR, signals_SR = dl.load_data_from_directory('samples/noisy_samples', 'samples/clean_samples/af_sig_HR.mat', 'samples/clean_samples/ardb_sig_HR.mat')
+gaf_SR = embedding_gaf.ecg_to_GAF_batch(np.stack([sig[:128] for sig in signals_SR[:4]]))
+
+results = {}
+for name, backend in [('eager', None)] + list(backends.items()):
+    diffusion.set_backend(backend)
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    results[name] = diffusion.p_sample_loop_batched(gaf_SR, sampler='ddim', sampling_steps=50)
+    print(f'{name}: {(time.perf_counter() - start) / 50 * 1e3:.1f} ms per step')
+
+diffusion.set_backend(None)
+for name in backends:
+    print(f'{name} vs eager samples: max abs difference {(results[name] - results["eager"]).abs().max().item():.2e}')
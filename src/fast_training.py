@@ -0,0 +1,54 @@
+import time
+import torch
+
+# Opt-in fast training path: autocast (bf16 on CPU, fp16/bf16 on CUDA), gradient
+# scaling for fp16, torch.compile of the denoising UNet and channels-last layout
+class FastTraining:
+    def __init__(self, model, device, enabled=False, amp_dtype='bfloat16', compile=True, channels_last=True):
+        self.device = torch.device(device)
+        self.enabled = enabled
+        self.amp_dtype = getattr(torch, amp_dtype)
+        if self.device.type == 'cpu' and self.amp_dtype == torch.float16:
+            print('float16 autocast is not supported on CPU, using bfloat16')
+            self.amp_dtype = torch.bfloat16
+        self.channels_last = enabled and channels_last
+
+        # Loss scaling is only needed for float16 (bfloat16 has the float32 range)
+        self.scaler = torch.cuda.amp.GradScaler(
+            enabled=enabled and self.amp_dtype == torch.float16 and self.device.type == 'cuda')
+
+        if self.channels_last:
+            model.to(memory_format=torch.channels_last)
+        if enabled and compile:
+            # compiled in place, state_dict keys stay the same (checkpoints remain loadable)
+            model.denoise_fn.compile()
+
+    def prepare(self, x):
+        # channels-last is a 4D (GAF field) layout, waveforms pass through
+        if self.channels_last and x.dim() == 4:
+            return x.contiguous(memory_format=torch.channels_last)
+        return x
+
+    def autocast(self):
+        return torch.autocast(device_type=self.device.type, dtype=self.amp_dtype, enabled=self.enabled)
+
+    def backward_step(self, loss, optimizer):
+        self.scaler.scale(loss).backward()
+        self.scaler.step(optimizer)
+        self.scaler.update()
+
+
+class Throughput:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.start = time.perf_counter()
+
+    def update(self, num_samples):
+        self.samples += num_samples
+
+    def rate(self):
+        # samples / sec since reset
+        return self.samples / max(time.perf_counter() - self.start, 1e-9)
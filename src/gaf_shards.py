@@ -0,0 +1,104 @@
+import os
+import json
+import bisect
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from embedding import EmbeddingGAF
+
+INDEX_FILE = 'index.json'
+
+
+def source_names(source):
+    # (clean, noisy) paths -> file names, independent of the working directory
+    return [os.path.basename(path) for path in source]
+
+
+# Offline GAF embedding: clean/noisy fields are written once to sharded .npy
+# files (memory-mapped) with an index file, training pages them in from disk.
+class GAFShardWriter:
+    def __init__(self, out_dir, shard_size=2500, window_size=128):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.window_size = window_size
+        self.embedding_gaf = EmbeddingGAF()
+
+    def write(self, clean_signals, noisy_signals, batch_size=500, source=None):
+        # source: (clean, noisy) file names the signals came from, kept in the index
+        # so a dataset built from other slices is refused at load time
+        if len(clean_signals) != len(noisy_signals):
+            raise ValueError("clean and noisy signals must have the same length")
+        os.makedirs(self.out_dir, exist_ok=True)
+
+        num_signals = len(clean_signals)
+        shards = []
+        for shard_id, start in enumerate(range(0, num_signals, self.shard_size)):
+            stop = min(start + self.shard_size, num_signals)
+            shard = {
+                'clean': f'clean_{shard_id:04d}.npy',
+                'noisy': f'noisy_{shard_id:04d}.npy',
+                'start': start,
+                'length': stop - start
+            }
+            for key, signals in (('clean', clean_signals), ('noisy', noisy_signals)):
+                self.write_array(os.path.join(self.out_dir, shard[key]), signals, start, stop, batch_size)
+            shards.append(shard)
+            print('Written shard', shard_id, 'signals', start, '-', stop)
+
+        # Index last (atomic), a crashed run never leaves a valid index behind
+        index = {'window_size': self.window_size, 'length': num_signals, 'shards': shards,
+                 'source': source_names(source) if source is not None else None}
+        tmp_path = os.path.join(self.out_dir, INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.out_dir, INDEX_FILE))
+        return index
+
+    def write_array(self, path, signals, start, stop, batch_size):
+        size = self.window_size
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                          shape=(stop - start, 1, size, size))
+        for i in range(start, stop, batch_size):
+            j = min(i + batch_size, stop)
+            windows = np.stack([np.asarray(sig[:size]) for sig in signals[i:j]])
+            array[i - start:j - start] = self.embedding_gaf.ecg_to_GAF_batch(windows).numpy()
+        array.flush()
+        del array
+
+
+class GAFShardDataset(Dataset):
+    def __init__(self, shard_dir, start=0, stop=None, source=None):
+        with open(os.path.join(shard_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        if source is not None and index.get('source') != source_names(source):
+            raise ValueError(f"Shards in '{shard_dir}' were built from {index.get('source')}, "
+                             f"expected {source_names(source)}")
+        self.shard_dir = shard_dir
+        self.shards = index['shards']
+        self.offsets = [shard['start'] for shard in self.shards]
+        self.start = start
+        self.stop = index['length'] if stop is None else min(stop, index['length'])
+        self.arrays = {}        # opened lazily, so every DataLoader worker maps its own
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def open_shard(self, shard_id):
+        if shard_id not in self.arrays:
+            shard = self.shards[shard_id]
+            # copy-on-write map: writable for torch.from_numpy, nothing is written back
+            self.arrays[shard_id] = (
+                np.load(os.path.join(self.shard_dir, shard['clean']), mmap_mode='c'),
+                np.load(os.path.join(self.shard_dir, shard['noisy']), mmap_mode='c')
+            )
+        return self.arrays[shard_id]
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        index += self.start
+        shard_id = bisect.bisect_right(self.offsets, index) - 1
+        clean, noisy = self.open_shard(shard_id)
+        local = index - self.offsets[shard_id]
+        return torch.from_numpy(clean[local]), torch.from_numpy(noisy[local])
@@ -1,10 +1,14 @@
 import torch
 import scipy.io
+import numpy as np
+from contextlib import nullcontext
 from torch import device
 
 from diffusion import GaussianDiffusion
 from unet import UNet
-from embedding import EmbeddingGAF
+from unet1d import UNet1D
+from embedding import EmbeddingGAF, EmbeddingSignal
+from profiling import DiffusionProfiler
 
 from visualizations import Visualizations
 from datahelper import DataHelper
@@ -14,12 +18,17 @@ from datahelper import DataHelper
 # AUX METHODS
 vis = Visualizations()
 embedding_gaf = EmbeddingGAF()
+embedding_signal = EmbeddingSignal()
 dl = DataHelper()
 
 #################################
 # CONFIGURE AND LOAD MODEL
 device = 'cpu'
 
+# Denoiser: 'gaf' (2D UNet on 128x128 GAF fields) or 'signal' (1D UNet on the waveform)
+representation = 'gaf'
+signal_length = 128
+
 # Parameters of the U-Net (denoising function)
 in_channels = 1*2                        
 out_channels = 1                        # Output will also be GrayScale
@@ -32,18 +41,34 @@ dropout = 0
 with_noise_level_emb = True
 image_size = 128
 
-denoise_fun = UNet(
-    in_channel=in_channels,
-    out_channel=out_channels,
-    inner_channel=inner_channels,
-    norm_groups=norm_groups,
-    channel_mults=channel_mults,
-    attn_res=attn_res,
-    res_blocks=res_blocks,
-    dropout=dropout,
-    with_noise_level_emb=with_noise_level_emb,
-    image_size=128
-).to(device)  
+if representation == 'gaf':
+    denoise_fun = UNet(
+        in_channel=in_channels,
+        out_channel=out_channels,
+        inner_channel=inner_channels,
+        norm_groups=norm_groups,
+        channel_mults=channel_mults,
+        attn_res=attn_res,
+        res_blocks=res_blocks,
+        dropout=dropout,
+        with_noise_level_emb=with_noise_level_emb,
+        image_size=128
+    ).to(device)
+    path_dn_model, path_diff_model = 'models/dn_model_1.pth', 'models/diff_model_1.pth'
+else:
+    denoise_fun = UNet1D(
+        in_channel=in_channels,
+        out_channel=out_channels,
+        inner_channel=inner_channels,
+        norm_groups=norm_groups,
+        channel_mults=channel_mults,
+        attn_res=attn_res,
+        res_blocks=res_blocks,
+        dropout=dropout,
+        with_noise_level_emb=with_noise_level_emb,
+        signal_length=signal_length
+    ).to(device)
+    path_dn_model, path_diff_model = 'models/dn_model_1d.pth', 'models/diff_model_1d.pth'
 
 # Noise schedule (from GitHub)
 config_diff = {
@@ -54,41 +79,82 @@ config_diff = {
 }
 
 # Load Pre-Trained Model
-denoise_fun.load_state_dict(torch.load('models/dn_model_1.pth', map_location=device))
+denoise_fun.load_state_dict(torch.load(path_dn_model, map_location=device))
 denoise_fun.eval()
 diffusion = GaussianDiffusion(denoise_fun, image_size=(128,128),channels=1,loss_type='l1',conditional=True,config_diff=config_diff).to(device)  # Move the diffusion model to the GPU if available
-diffusion.load_state_dict(torch.load('models/diff_model_1.pth', map_location=device))
+diffusion.load_state_dict(torch.load(path_diff_model, map_location=device))
 
 print('Status: Diffusion and denoising model loaded successfully')
 
+# Precompute the noise-level embeddings of all timesteps (inference only)
+use_noise_cache = True
+if use_noise_cache:
+    diffusion.build_noise_cache()
+
+# Sampler ('ddpm' or 'ddim') and number of reverse steps (None -> all 2000)
+sampler = 'ddpm'
+sampling_steps = None
+
+# Adaptive early stopping (ddpm, ddim): a sample leaves the batch once its x_0 prediction
+# stops changing (diffusion.adaptive_tol / adaptive_patience)
+adaptive_sampling = False
+
+# Partial trajectory (SDEdit): start from the condition diffused to t* and run only t* steps
+# None (full chain from noise), a timestep, one timestep per signal, or 'auto' (from the estimated input SNR)
+start_t = None
+
+# Profiling (opt-in): per-module / per-step times, allocations and copies of the batched
+# sampling, exported as a Chrome trace and a JSON summary (use few sampling_steps)
+profile_sampling = False
+
 #################################
 # LOAD SAMPLES
 signals_HR , signals_SR = dl.load_data_from_directory('samples/noisy_samples', 'samples/clean_samples/af_sig_HR.mat', 'samples/clean_samples/ardb_sig_HR.mat')
 
 num_of_shots = 1
 
-for i in range(len(signals_HR)):
+# Batched: all signals and shots go through one reverse loop (UNet batch <= max_batch_size)
+batched_inference = True
+max_batch_size = 32
 
-    gaf_HR = embedding_gaf.ecg_to_GAF(signals_HR[i])
-    gaf_SR = embedding_gaf.ecg_to_GAF(signals_SR[i])
+if batched_inference or representation == 'signal':
 
-    ############################
-    # INFERENCE 
-    for j in range(num_of_shots):
+    # STACK (signal i, shot j) -> row i * num_of_shots + j
+    if representation == 'gaf':
+        x_SR = embedding_gaf.ecg_to_GAF_batch(np.stack([sig[:128] for sig in signals_SR]), device=device)
+    else:
+        x_SR = embedding_signal.ecg_to_signal_batch(np.stack([sig[:signal_length] for sig in signals_SR]), device=device)
+    x = x_SR.repeat_interleave(num_of_shots, dim=0)
+    start_t_runs = start_t if start_t is None or isinstance(start_t, str) else \
+        torch.as_tensor(start_t).reshape(-1).expand(x_SR.shape[0]).repeat_interleave(num_of_shots)
 
-        print('Sampling... run', i)
+    print('Sampling...', x.shape[0], 'runs in batches of', max_batch_size)
 
-        # FLOAT.32
-        x = gaf_SR.to("cpu")   
-        x = x.to(torch.float32)
+    # SAMPLE TENSORS
+    with DiffusionProfiler(diffusion) if profile_sampling else nullcontext() as profiler:
+        sampled_tensors = diffusion.p_sample_loop_batched(x, max_batch_size=max_batch_size, sampler=sampler, sampling_steps=sampling_steps,
+                                                          adaptive=adaptive_sampling, start_t=start_t_runs)
 
-        # SAMPLE TENSOR
-        sampled_tensor = diffusion.p_sample_loop_single(x)
-        sampled_tensor = sampled_tensor.unsqueeze(0)
+    if profile_sampling:
+        profiler.export_chrome_trace('sampling_trace.json')
+        profiler.export_summary('sampling_profile.json')
+        print('Saved as: sampling_trace.json, sampling_profile.json')
+
+    if adaptive_sampling or start_t is not None:
+        num_steps = len(diffusion.sampling_timesteps(sampling_steps))
+        for k, saved in enumerate(diffusion.steps_saved.tolist()):
+            print(f'Run {k}: {num_steps - saved}/{num_steps} reverse steps ({saved} saved)')
+        print(f'Mean steps saved: {diffusion.steps_saved.float().mean().item():.1f}/{num_steps}')
+
+    for k in range(sampled_tensors.shape[0]):
+        i, j = divmod(k, num_of_shots)
+
+        # RECOVER SIGNAL (rescaled [-1, 1], (N, 1) like the GAF reconstructions)
+        if representation == 'gaf':
+            sig_rec = embedding_gaf.GAF_to_ecg(sampled_tensors[k])
+        else:
+            sig_rec = sampled_tensors[k, 0].cpu().numpy()[:, None]
 
-        # RECOVER SIGNAL
-        sig_rec = embedding_gaf.GAF_to_ecg(sampled_tensor)
-        
         # SAVE
         filename_rec =  str(i) + 'sig_rec_' + str(j) + '.mat'
 
@@ -97,5 +163,34 @@ for i in range(len(signals_HR)):
         # Save the array to a .mat file
         scipy.io.savemat(filename_rec, {'sig_rec': sig_rec})
 
+else:
+
+    for i in range(len(signals_HR)):
+
+        gaf_HR = embedding_gaf.ecg_to_GAF(signals_HR[i])
+        gaf_SR = embedding_gaf.ecg_to_GAF(signals_SR[i])
+
+        ############################
+        # INFERENCE 
+        for j in range(num_of_shots):
+
+            print('Sampling... run', i)
+
+            # FLOAT.32
+            x = gaf_SR.to("cpu")   
+            x = x.to(torch.float32)
+
+            # SAMPLE TENSOR
+            sampled_tensor = diffusion.p_sample_loop_single(x, sampler=sampler, sampling_steps=sampling_steps)
+            sampled_tensor = sampled_tensor.unsqueeze(0)
+
+            # RECOVER SIGNAL
+            sig_rec = embedding_gaf.GAF_to_ecg(sampled_tensor)
+        
+            # SAVE
+            filename_rec =  str(i) + 'sig_rec_' + str(j) + '.mat'
 
+            print('Saved as:', filename_rec)
 
+            # Save the array to a .mat file
+            scipy.io.savemat(filename_rec, {'sig_rec': sig_rec})
@@ -0,0 +1,68 @@
+import json
+import time
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from denoiser import Denoiser
+from datahelper import DataHelper
+
+# Load test of server.py (start it first): concurrent single-window requests against
+# its batcher (dynamic or continuous, as reported by /health), then the same windows
+# sampled one by one (naive per request) with the same sampler and number of steps
+
+#################################
+# CONFIG
+url = 'http://127.0.0.1:8080'
+num_requests = 64
+concurrency = 32                    # clients sending at the same time
+num_naive = 8                       # per-request baseline is slow, time a few windows
+
+def get(path):
+    with urllib.request.urlopen(url + path) as response:
+        return json.loads(response.read())
+
+def post_window(window):
+    body = json.dumps({'signals': [window.tolist()]}).encode()
+    request = urllib.request.Request(url + '/denoise', data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        json.loads(response.read())
+    return time.perf_counter() - start
+
+#################################
+# WINDOWS (noisy samples, cycled)
+health = get('/health')
+print('Server:', health)
+signal_length = health['signal_length']
+batching = health['batching']
+
+dl = DataHelper()
+_, signals_SR = dl.load_data_from_directory('samples/noisy_samples', 'samples/clean_samples/af_sig_HR.mat', 'samples/clean_samples/ardb_sig_HR.mat')
+windows = np.stack([np.asarray(signals_SR[k % len(signals_SR)][:signal_length], dtype=np.float32).squeeze()
+                    for k in range(num_requests)])
+
+#################################
+# BATCHED (server)
+start = time.perf_counter()
+with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    latencies = np.array(list(pool.map(post_window, windows)))
+elapsed = time.perf_counter() - start
+batched_rate = num_requests / elapsed
+
+stats = get('/stats')
+print(f'Batched ({batching}): {num_requests} requests in {elapsed:.2f} s, {batched_rate:.2f} signals/s, '
+      f'latency p50 {np.percentile(latencies, 50):.2f} s, p95 {np.percentile(latencies, 95):.2f} s, '
+      f'mean batch size {stats["mean_batch_size"]:.1f}')
+
+#################################
+# NAIVE (one reverse diffusion run per request)
+denoiser = Denoiser(sampler=health['sampler'], max_batch_size=1)
+start = time.perf_counter()
+for window in windows[:num_naive]:
+    denoiser.denoise(window, steps=health['steps'], shots=health['shots'])
+elapsed = time.perf_counter() - start
+naive_rate = num_naive / elapsed
+
+print(f'Naive:   {num_naive} requests in {elapsed:.2f} s, {naive_rate:.2f} signals/s')
+print(f'Speedup of {batching} batching: {batched_rate / naive_rate:.2f}x')
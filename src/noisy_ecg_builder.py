@@ -1,73 +1,83 @@
-import wfdb
+import os
+import tempfile
 import numpy as np
 
-from scipy.signal import resample
+from math import gcd
+from scipy.signal import resample, resample_poly
+
+NOISE_TYPES = ('em', 'ma', 'bw')
+
+
+# NSTDB noise records resampled once (polyphase) and cached as .npy next to the
+# records; the cache is memory-mapped, so a random slice only reads that slice
+class NoiseBank:
+    def __init__(self, noise_dir='data/nstdb', cache_dir=None, fs_record=360, fs_target=128, channel=0):
+        self.noise_dir = noise_dir
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(noise_dir, 'cache')
+        self.fs_record = fs_record
+        self.fs_target = fs_target
+        self.channel = channel
+        self.records = {}       # noise type -> memory-mapped resampled record
+
+    def cache_path(self, noise_type):
+        return os.path.join(self.cache_dir, f'{noise_type}_ch{self.channel}_{self.fs_record}to{self.fs_target}.npy')
+
+    def cache_valid(self, path, source):
+        # rebuilt when the record is newer than its cache
+        if not os.path.exists(path):
+            return False
+        source_dat = source + '.dat'
+        return not os.path.exists(source_dat) or os.path.getmtime(path) >= os.path.getmtime(source_dat)
+
+    def build_cache(self, noise_type, path):
+        import wfdb     # only needed to read the NSTDB records
+
+        record = wfdb.rdsamp(os.path.join(self.noise_dir, noise_type))[0][:, self.channel]
+        g = gcd(self.fs_target, self.fs_record)
+        resampled = resample_poly(record, self.fs_target // g, self.fs_record // g)
+
+        # write to a temporary file first, a crashed run never leaves a partial cache behind;
+        # one per process, DataLoader workers may build the same cache at the same time
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=os.path.basename(path)[:-len('.npy')] + '.',
+                                        suffix='.tmp.npy')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, resampled)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def record(self, noise_type):
+        if noise_type not in NOISE_TYPES:
+            raise ValueError(f"Unknown noise type '{noise_type}', choose from {NOISE_TYPES}")
+        if noise_type not in self.records:
+            path = self.cache_path(noise_type)
+            if not self.cache_valid(path, os.path.join(self.noise_dir, noise_type)):
+                self.build_cache(noise_type, path)
+            self.records[noise_type] = np.load(path, mmap_mode='r')
+        return self.records[noise_type]
+
 
 class NoisyECGBuilder:
 
-    def __init__(self):
-        pass
+    def __init__(self, noise_bank=None):
+        self.noise_bank = noise_bank if noise_bank is not None else NoiseBank()
 
     def add_noise_to_ecg(self, ecg_signal, noise_type='em', snr=10):
-        
-        slice_length = len(ecg_signal)
-        print('Length of ECG signal', slice_length)
-
-        if noise_type == 'em':
-            path_to_noise_record = "data/nstdb/em" 
-            record_em = wfdb.rdsamp(path_to_noise_record)
-            noise_em = record_em[0][:, 0]
-            noise_em = self.resample_signal(noise_em, 360, 128) 
-            noise_em_128_samp = self.pick_random_slice(noise_em,slice_length)
-            noisy_signal = self.noise_adder(ecg_signal,noise_em_128_samp,snr)
-            return noisy_signal
-        
-        if noise_type == 'ma':
-            path_to_noise_record = "data/nstdb/ma" 
-            record_ma = wfdb.rdsamp(path_to_noise_record)
-            noise_ma = record_ma[0][:, 0]
-            noise_ma = self.resample_signal(noise_ma, 360, 128)
-            noise_ma_128_samp = self.pick_random_slice(noise_ma,slice_length)
-            noisy_signal = self.noise_adder(ecg_signal,noise_ma_128_samp,snr)
-            return noisy_signal
-        
-        if noise_type == 'bw':
-            path_to_noise_record = "data/nstdb/bw" 
-            record_bw = wfdb.rdsamp(path_to_noise_record)
-            noise_bw= record_bw[0][:, 0]
-            noise_bw = self.resample_signal(noise_bw, 360, 128) 
-            noise_bw_128_samp = self.pick_random_slice(noise_bw,slice_length)
-            noisy_signal = self.noise_adder(ecg_signal,noise_bw_128_samp,snr)
-            return noisy_signal
+        noise_slice = self.get_noisy_slice(ecg_signal, noise_type)
+        noisy_signal = self.noise_adder(ecg_signal, noise_slice, snr)
+        return noisy_signal
 
     def get_noisy_slice(self,ecg_signal,noise_type):
         
         slice_length = len(ecg_signal)
-        print('Length of ECG signal', slice_length)
-
-        if noise_type == 'em':
-            path_to_noise_record = "data/nstdb/em" 
-            record_em = wfdb.rdsamp(path_to_noise_record)
-            noise_em = record_em[0][:, 0]
-            noise_em = self.resample_signal(noise_em, 360, 128) 
-            noise_em_128_samp = self.pick_random_slice(noise_em,slice_length)
-            return noise_em_128_samp
-        
-        if noise_type == 'ma':
-            path_to_noise_record = "data/nstdb/ma" 
-            record_ma = wfdb.rdsamp(path_to_noise_record)
-            noise_ma = record_ma[0][:, 0]
-            noise_ma = self.resample_signal(noise_ma, 360, 128)
-            noise_ma_128_samp = self.pick_random_slice(noise_ma,slice_length)
-            return noise_ma_128_samp
-        
-        if noise_type == 'bw':
-            path_to_noise_record = "data/nstdb/bw" 
-            record_bw = wfdb.rdsamp(path_to_noise_record)
-            noise_bw= record_bw[0][:, 0]
-            noise_bw = self.resample_signal(noise_bw, 360, 128) 
-            noise_bw_128_samp = self.pick_random_slice(noise_bw,slice_length)
-            return noise_bw_128_samp
+
+        # resampled (128 Hz) record from the noise bank, loaded on first use
+        noise = self.noise_bank.record(noise_type)
+        noise_slice = self.pick_random_slice(noise, slice_length)
+        return np.array(noise_slice)        # copy of the slice, detached from the cache file
 
 
     def noise_adder(self, ecg_signal, noise_signal, snr_dB):
@@ -0,0 +1,144 @@
+import json
+import time
+import torch
+from torch import nn
+from torch.profiler import profile, record_function, ProfilerActivity
+
+# Opt-in profiling of sampling/training: wall time per UNet submodule and per
+# reverse step, allocations and host-device copies, exported as a Chrome trace
+# (chrome://tracing, Perfetto) and a JSON summary. Hooks are only attached inside
+# the `with DiffusionProfiler(diffusion):` block and removed on exit, so nothing
+# runs when profiling is off.
+class DiffusionProfiler:
+    def __init__(self, diffusion, record_memory=True, record_shapes=False):
+        self.diffusion = diffusion
+        self.record_memory = record_memory
+        self.record_shapes = record_shapes
+        self.sync = diffusion.betas.is_cuda        # time kernels, not their launches
+        self.handles = []
+        self.open_ranges = {}       # module name -> [(start, range)], recursion safe
+        self.module_times = {}      # module name -> [calls, total seconds]
+        self.module_types = {}      # module name -> class name
+        self.step_times = []        # (t, seconds) per reverse step
+        self.profiler = None
+
+    # ********************************
+    # Enable / disable
+    def __enter__(self):
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.profiler = profile(activities=activities, profile_memory=self.record_memory,
+                                record_shapes=self.record_shapes)
+        self.profiler.__enter__()
+        self.attach_module_hooks()
+        self.wrap_sampler_step()
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        # drop the instance attribute, the class method is visible again
+        self.diffusion.__dict__.pop('sampler_step', None)
+        self.profiler.__exit__(*exc)
+        return False
+
+    def attach_module_hooks(self):
+        for name, module in self.diffusion.denoise_fn.named_modules():
+            if not name or isinstance(module, (nn.ModuleList, nn.Sequential)):
+                continue        # root (per-step timing) and plain containers
+            self.module_types[name] = type(module).__name__
+            self.handles.append(module.register_forward_pre_hook(self.pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self.post_hook(name)))
+
+    def pre_hook(self, name):
+        def hook(module, inputs):
+            trace_range = record_function('unet.' + name)
+            trace_range.__enter__()
+            if self.sync:
+                torch.cuda.synchronize()
+            self.open_ranges.setdefault(name, []).append((time.perf_counter(), trace_range))
+        return hook
+
+    def post_hook(self, name):
+        def hook(module, inputs, output):
+            if self.sync:
+                torch.cuda.synchronize()
+            start, trace_range = self.open_ranges[name].pop()
+            stats = self.module_times.setdefault(name, [0, 0.])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+            trace_range.__exit__(None, None, None)
+        return hook
+
+    def wrap_sampler_step(self):
+        sampler_step = self.diffusion.sampler_step
+
+        def profiled_sampler_step(sampler, x, t, t_prev, *args, **kwargs):
+            label = t if not torch.is_tensor(t) else f'{int(t.min())}..{int(t.max())}'
+            with record_function(f'reverse_step t={label}'):
+                if self.sync:
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                out = sampler_step(sampler, x, t, t_prev, *args, **kwargs)
+                if self.sync:
+                    torch.cuda.synchronize()
+                self.step_times.append((label, time.perf_counter() - start))
+            return out
+        # instance attribute shadows GaussianDiffusion.sampler_step while profiling
+        self.diffusion.sampler_step = profiled_sampler_step
+
+    # ********************************
+    # Results
+    def summary(self, top_k=20):
+        events = self.profiler.key_averages()
+
+        # inclusive wall time: a block contains its norms, convs and attention
+        modules = {name: {'type': self.module_types[name], 'calls': calls, 'total': total, 'mean': total / calls}
+                   for name, (calls, total) in self.module_times.items()}
+        by_type = {}
+        for stats in modules.values():
+            entry = by_type.setdefault(stats['type'], {'calls': 0, 'total': 0.})
+            entry['calls'] += stats['calls']
+            entry['total'] += stats['total']
+
+        step_seconds = [seconds for _, seconds in self.step_times]
+        steps = {
+            'count': len(step_seconds),
+            'total': sum(step_seconds),
+            'mean': sum(step_seconds) / max(len(step_seconds), 1),
+            'per_step': [{'t': t, 'seconds': seconds} for t, seconds in self.step_times]
+        }
+
+        def memory(evt, kind):
+            # attribute names differ between torch versions (cuda_* -> device_*)
+            for attr in (kind.replace('cuda', 'device'), kind):
+                if hasattr(evt, attr):
+                    return getattr(evt, attr)
+            return 0
+
+        allocations = sorted(
+            ({'op': evt.key, 'calls': evt.count,
+              'self_cpu_memory_bytes': evt.self_cpu_memory_usage,
+              'self_cuda_memory_bytes': memory(evt, 'self_cuda_memory_usage')} for evt in events),
+            key=lambda a: max(abs(a['self_cpu_memory_bytes']), abs(a['self_cuda_memory_bytes'])), reverse=True)[:top_k]
+
+        copies = {evt.key: {'calls': evt.count, 'cpu_time_total_us': evt.cpu_time_total}
+                  for evt in events if 'Memcpy' in evt.key or evt.key in ('aten::_to_copy', 'aten::copy_')}
+
+        return {
+            'modules': dict(sorted(modules.items(), key=lambda kv: kv[1]['total'], reverse=True)),
+            'module_types': dict(sorted(by_type.items(), key=lambda kv: kv[1]['total'], reverse=True)),
+            'steps': steps,
+            'allocations': allocations,
+            'copies': copies,
+            'peak_cuda_memory_bytes': torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None
+        }
+
+    def export_chrome_trace(self, path):
+        self.profiler.export_chrome_trace(path)
+
+    def export_summary(self, path, top_k=20):
+        with open(path, 'w') as f:
+            json.dump(self.summary(top_k), f, indent=2)
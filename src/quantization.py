@@ -0,0 +1,79 @@
+import copy
+import time
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import QConfigMapping, get_default_qconfig, quantize_dynamic
+from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from unet import PositionalEncoding, SelfAttention, TraceableUNet
+
+
+# Int8 UNet for CPU inference
+#   'static':  Conv2d / Linear (and GroupNorm where the backend has a kernel) with
+#              int8 weights and activations, calibrated on real inputs (FX graph mode)
+#   'dynamic': int8 Linear weights only, activations quantized on the fly
+class UNetQuantizer:
+    def __init__(self, backend='x86'):
+        self.backend = backend
+        torch.backends.quantized.engine = backend
+
+    def quantize(self, unet, mode='static', calibration_inputs=None):
+        unet = copy.deepcopy(unet).cpu().eval()
+        if hasattr(unet, 'clear_noise_cache'):
+            unet.clear_noise_cache()
+        if mode == 'dynamic':
+            return quantize_dynamic(unet, {nn.Linear}, dtype=torch.qint8)
+        elif mode == 'static':
+            if not calibration_inputs:
+                raise ValueError("Static quantization needs calibration inputs")
+            return self.quantize_static(unet, calibration_inputs)
+        else:
+            raise NotImplementedError()
+
+    def quantize_static(self, unet, calibration_inputs):
+        qconfig = get_default_qconfig(self.backend)
+        qconfig_mapping = QConfigMapping() \
+            .set_object_type(nn.Conv2d, qconfig) \
+            .set_object_type(nn.Linear, qconfig) \
+            .set_object_type(nn.GroupNorm, qconfig)
+        # attention (math on shapes) and the positional encoding are kept in float
+        prepare_custom_config = PrepareCustomConfig().set_non_traceable_module_classes(
+            [SelfAttention, PositionalEncoding])
+
+        prepared = prepare_fx(TraceableUNet(unet), qconfig_mapping,
+                              example_inputs=calibration_inputs[0],
+                              prepare_custom_config=prepare_custom_config)
+        with torch.no_grad():
+            for inputs in calibration_inputs:
+                prepared(*inputs)
+        return convert_fx(prepared)
+
+    @torch.no_grad()
+    def calibration_inputs(self, diffusion, gaf_HR, gaf_SR, num_timesteps=32):
+        # UNet inputs as seen during sampling: (cat[condition, x_t], noise_level) for
+        # timesteps spread over the schedule, x_t is q_sample of the clean field
+        inputs = []
+        for t in np.linspace(0, diffusion.num_timesteps - 1, num_timesteps).round().astype(int):
+            noise_level = torch.full((gaf_HR.shape[0], 1), float(diffusion.sqrt_alphas_cumprod_prev[t + 1]))
+            x_t = diffusion.q_sample(gaf_HR, noise_level.view(-1, 1, 1, 1))
+            inputs.append((torch.cat([gaf_SR, x_t], dim=1), noise_level))
+        return inputs
+
+    @torch.no_grad()
+    def time_forward(self, model, inputs, repeats=10):
+        # Mean seconds per UNet forward (one reverse step)
+        model(*inputs)          # warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(*inputs)
+        return (time.perf_counter() - start) / repeats
+
+    def drift(self, signals, references):
+        # RMSE and correlation per signal, (N, L) arrays
+        signals = np.asarray(signals, dtype=np.float64)
+        references = np.asarray(references, dtype=np.float64)
+        rmse = np.sqrt(np.mean((signals - references) ** 2, axis=1))
+        corr = np.array([np.corrcoef(s, r)[0, 1] for s, r in zip(signals, references)])
+        return rmse, corr
@@ -0,0 +1,137 @@
+import os
+import json
+import torch
+import scipy.io
+import numpy as np
+
+from diffusion import GaussianDiffusion
+from unet import UNet
+from embedding import EmbeddingGAF
+from datahelper import DataHelper
+from quantization import UNetQuantizer
+
+# Int8 UNet for CPU inference: calibrate on src/samples, time one reverse step
+# against fp32 and report the drift against the fp32 reconstructions (model 1)
+
+#################################
+# AUX METHODS
+embedding_gaf = EmbeddingGAF()
+dl = DataHelper()
+
+#################################
+# CONFIGURE AND LOAD MODEL
+device = 'cpu'
+
+# Parameters of the U-Net (denoising function)
+in_channels = 1*2
+out_channels = 1                        # Output will also be GrayScale
+inner_channels = 32                     # Depth feature maps, model complexity
+norm_groups = 32                        # Granularity of normalization, impacting convergence
+channel_mults = (1, 2, 4, 8, 8)
+attn_res = [8]
+res_blocks = 3
+dropout = 0
+with_noise_level_emb = True
+image_size = 128
+
+denoise_fun = UNet(
+    in_channel=in_channels,
+    out_channel=out_channels,
+    inner_channel=inner_channels,
+    norm_groups=norm_groups,
+    channel_mults=channel_mults,
+    attn_res=attn_res,
+    res_blocks=res_blocks,
+    dropout=dropout,
+    with_noise_level_emb=with_noise_level_emb,
+    image_size=128
+).to(device)
+
+config_diff = {
+    'beta_start': 1e-6,
+    'beta_end': 1e-2,
+    'num_steps': 2000,
+    'schedule': "linear"
+}
+
+denoise_fun.load_state_dict(torch.load('models/dn_model_1.pth', map_location=device))
+denoise_fun.eval()
+diffusion = GaussianDiffusion(denoise_fun, image_size=(128,128),channels=1,loss_type='l1',conditional=True,config_diff=config_diff).to(device)
+diffusion.load_state_dict(torch.load('models/diff_model_1.pth', map_location=device))
+
+print('Status: Diffusion and denoising model loaded successfully')
+
+# Quantization ('static' or 'dynamic'), sampling setup of the drift check
+quantization_mode = 'static'
+num_calibration_timesteps = 32
+sampler = 'ddpm'
+sampling_steps = None                   # the fp32 reconstructions used all 2000 steps
+max_batch_size = 16
+path_reconstructions = '../reconstructions/model_1'
+
+#################################
+# LOAD SAMPLES (sorted, same order as DataHelper)
+path_noisy = 'samples/noisy_samples'
+signal_names = [f[:-4] for f in sorted(os.listdir(path_noisy)) if f.endswith('.mat')]
+signals_HR, signals_SR = dl.load_data_from_directory(path_noisy, 'samples/clean_samples/af_sig_HR.mat', 'samples/clean_samples/ardb_sig_HR.mat')
+
+gaf_HR = embedding_gaf.ecg_to_GAF_batch(np.stack([sig[:128] for sig in signals_HR]))
+gaf_SR = embedding_gaf.ecg_to_GAF_batch(np.stack([sig[:128] for sig in signals_SR]))
+
+#################################
+# QUANTIZE
+quantizer = UNetQuantizer(backend='x86')
+calibration_inputs = quantizer.calibration_inputs(diffusion, gaf_HR, gaf_SR, num_timesteps=num_calibration_timesteps)
+denoise_int8 = quantizer.quantize(denoise_fun, mode=quantization_mode, calibration_inputs=calibration_inputs)
+
+print('Status: UNet quantized to int8 (' + quantization_mode + ')')
+
+# TIME ONE REVERSE STEP (batch of all samples)
+step_inputs = calibration_inputs[len(calibration_inputs) // 2]
+time_fp32 = quantizer.time_forward(denoise_fun, step_inputs)
+time_int8 = quantizer.time_forward(denoise_int8, step_inputs)
+
+print(f'UNet forward (batch {gaf_SR.shape[0]}): fp32 {time_fp32*1e3:.1f} ms, int8 {time_int8*1e3:.1f} ms, speedup {time_fp32/time_int8:.2f}x')
+
+#################################
+# SAMPLE WITH THE INT8 UNET
+diffusion.denoise_fn = denoise_int8
+sampled_tensors = diffusion.p_sample_loop_batched(gaf_SR, max_batch_size=max_batch_size, sampler=sampler, sampling_steps=sampling_steps)
+
+# Same recovery as inference.py, comparable with the stored sig_rec_*.mat
+sig_rec_int8 = np.stack([embedding_gaf.GAF_to_ecg(sampled_tensors[k]).squeeze() for k in range(sampled_tensors.shape[0])])
+
+#################################
+# DRIFT AGAINST THE FP32 RECONSTRUCTIONS
+report = {
+    'mode': quantization_mode,
+    'step_time_fp32': time_fp32,
+    'step_time_int8': time_int8,
+    'speedup': time_fp32 / time_int8,
+    'signals': {}
+}
+
+for k, name in enumerate(signal_names):
+    path_rec = os.path.join(path_reconstructions, name.replace('_sig_SR', ''))
+    if not os.path.isdir(path_rec):
+        print('No fp32 reconstructions for', name)
+        continue
+    shots_fp32 = np.stack([scipy.io.loadmat(os.path.join(path_rec, f))['sig_rec'].squeeze()
+                           for f in sorted(os.listdir(path_rec)) if f.endswith('.mat')])
+    mean_fp32 = shots_fp32.mean(axis=0)
+
+    # int8 vs the multi-shot fp32 mean, and the fp32 shot-to-shot spread as a reference
+    rmse, corr = quantizer.drift(sig_rec_int8[k:k+1], mean_fp32[None])
+    rmse_shots, _ = quantizer.drift(shots_fp32, np.repeat(mean_fp32[None], len(shots_fp32), axis=0))
+
+    report['signals'][name] = {
+        'rmse_int8': float(rmse[0]),
+        'corr_int8': float(corr[0]),
+        'rmse_fp32_shots': float(rmse_shots.mean())
+    }
+    print(f'{name}: int8 RMSE {rmse[0]:.4f} (fp32 shots {rmse_shots.mean():.4f}), corr {corr[0]:.4f}')
+
+with open('quantization_report.json', 'w') as f:
+    json.dump(report, f, indent=2)
+
+print('Saved as: quantization_report.json')
@@ -0,0 +1,326 @@
+import json
+import queue
+import threading
+import time
+import numpy as np
+import torch
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from denoiser import Denoiser
+from continuous_batching import ContinuousBatchScheduler
+
+# Local denoising service (localhost only, no external dependencies):
+#   POST /denoise   {"signals": [[...], ...]}  ->  {"signals": [[...], ...], "latency": s}
+#   GET  /health    model and queue status
+#   GET  /stats     throughput, batch sizes and latencies
+# Concurrent requests are queued and coalesced into one reverse diffusion run of
+# at most max_batch_size windows, a batch starts when it is full or max_latency
+# seconds after its first request arrived (DynamicBatcher), or requests join the
+# running batch at the next reverse step (ContinuousBatcher).
+
+
+class Request:
+    def __init__(self, signals):
+        self.signals = signals
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class DynamicBatcher:
+    mode = 'dynamic'        # reported as 'batching' by /health
+
+    def __init__(self, denoiser, max_batch_size=32, max_latency=0.05, steps=None, shots=1):
+        self.denoiser = denoiser
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.steps = steps
+        self.shots = shots
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.reset_stats()
+        self.thread = threading.Thread(target=self.run, name='dynamic-batcher', daemon=True)
+        self.thread.start()
+
+    def reset_stats(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.num_requests = 0
+            self.num_signals = 0
+            self.num_batches = 0
+            self.busy_time = 0.
+            self.total_latency = 0.
+            self.max_latency_seen = 0.
+
+    def submit(self, signals):
+        # signals (B, N) windows -> Future of the (B, N) denoised windows
+        signals = np.atleast_2d(np.asarray(signals, dtype=np.float32))
+        if signals.ndim != 2 or signals.shape[1] != self.denoiser.signal_length:
+            raise ValueError(f"Expected windows of {self.denoiser.signal_length} samples")
+        request = Request(signals)
+        with self.lock:
+            # queued before close()'s sentinel, so every accepted request is answered
+            if self.closed:
+                raise RuntimeError('Batcher is closed')
+            self.queue.put(request)
+        return request.future
+
+    def collect(self, first):
+        # first request + whatever arrives before the batch is full or the deadline passes
+        pending = [first]
+        count = len(first.signals)
+        deadline = time.perf_counter() + self.max_latency
+        while count < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)        # stop after this batch
+                break
+            pending.append(request)
+            count += len(request.signals)
+        return pending
+
+    def run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            self.process(self.collect(first))
+
+    def process(self, pending):
+        start = time.perf_counter()
+        try:
+            denoised = self.denoiser.denoise(np.concatenate([r.signals for r in pending]),
+                                             steps=self.steps, shots=self.shots)
+        except Exception as e:
+            for request in pending:
+                request.future.set_exception(e)
+            return
+        end = time.perf_counter()
+
+        offset = 0
+        for request in pending:
+            request.future.set_result(denoised[offset:offset + len(request.signals)])
+            offset += len(request.signals)
+
+        with self.lock:
+            self.num_requests += len(pending)
+            self.num_signals += offset
+            self.num_batches += 1
+            self.busy_time += end - start
+            for request in pending:
+                latency = end - request.submitted
+                self.total_latency += latency
+                self.max_latency_seen = max(self.max_latency_seen, latency)
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            return {
+                'requests': self.num_requests,
+                'signals': self.num_signals,
+                'batches': self.num_batches,
+                'mean_batch_size': self.num_signals / max(self.num_batches, 1),
+                'signals_per_sec': self.num_signals / max(elapsed, 1e-9),
+                'busy_fraction': self.busy_time / max(elapsed, 1e-9),
+                'mean_latency': self.total_latency / max(self.num_requests, 1),
+                'max_latency': self.max_latency_seen,
+                'queued': self.queue.qsize(),
+                'uptime': elapsed
+            }
+
+    def close(self):
+        # New requests are rejected, the queued and running ones are finished first
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(None)
+        self.thread.join()
+
+
+class ContinuousBatcher(DynamicBatcher):
+    # Step-level scheduling: windows join/leave the running batch at any reverse step.
+    # 'batches' in the stats counts reverse steps, mean_batch_size the running samples per step
+    mode = 'continuous'
+
+    def __init__(self, denoiser, max_batch_size=32, steps=None, shots=1):
+        self.scheduler = ContinuousBatchScheduler(denoiser.diffusion, max_batch_size=max_batch_size,
+                                                  sampler=denoiser.sampler, sampling_steps=steps)
+        self.owners = {}        # scheduler id -> (request, row)
+        super().__init__(denoiser, max_batch_size=max_batch_size, max_latency=0., steps=steps, shots=shots)
+
+    def reset_stats(self):
+        super().reset_stats()
+        with self.lock:
+            self.step_rows = 0
+
+    def admit(self, request):
+        # embed on arrival, every shot is a separate sample in the scheduler
+        try:
+            x, request.scale = self.denoiser.embed(request.signals)
+        except Exception as e:
+            request.future.set_exception(e)
+            return
+        ids = self.scheduler.add(x.repeat_interleave(self.shots, dim=0))
+        request.samples = [None] * len(ids)
+        request.remaining = len(ids)
+        for row, i in enumerate(ids):
+            self.owners[i] = (request, row)
+
+    def run(self):
+        stopping = False
+        while True:
+            # take the new requests, block only when nothing is running
+            try:
+                while not stopping:
+                    request = self.queue.get(block=self.scheduler.idle())
+                    if request is None:
+                        stopping = True     # close(): finish the samples in flight, then stop
+                    else:
+                        self.admit(request)
+            except queue.Empty:
+                pass
+            if stopping and self.scheduler.idle():
+                return
+
+            rows = len(self.scheduler.ids) + min(len(self.scheduler.waiting), self.max_batch_size - len(self.scheduler.ids))
+            start = time.perf_counter()
+            try:
+                finished = self.scheduler.step()
+            except Exception as e:
+                for request, _ in self.owners.values():
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                self.owners.clear()
+                self.scheduler = ContinuousBatchScheduler(self.denoiser.diffusion, max_batch_size=self.max_batch_size,
+                                                          sampler=self.denoiser.sampler, sampling_steps=self.steps)
+                continue
+            with self.lock:
+                self.num_batches += 1
+                self.step_rows += rows
+                self.busy_time += time.perf_counter() - start
+
+            for i, sample in finished:
+                request, row = self.owners.pop(i)
+                request.samples[row] = sample
+                request.remaining -= 1
+                if request.remaining == 0:
+                    self.finish(request)
+
+    def finish(self, request):
+        scale = tuple(s.repeat_interleave(self.shots, dim=0) for s in request.scale)
+        denoised = self.denoiser.recover(torch.stack(request.samples), scale).cpu().numpy()
+        request.future.set_result(denoised.reshape(len(request.signals), self.shots, -1).mean(axis=1))
+        end = time.perf_counter()
+        with self.lock:
+            self.num_requests += 1
+            self.num_signals += len(request.signals)
+            latency = end - request.submitted
+            self.total_latency += latency
+            self.max_latency_seen = max(self.max_latency_seen, latency)
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats['mean_batch_size'] = self.step_rows / max(self.num_batches, 1)
+        stats['in_flight'] = len(self.scheduler)
+        return stats
+
+
+class DenoiseHandler(BaseHTTPRequestHandler):
+    # self.server.batcher is set by serve()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        batcher = self.server.batcher
+        if self.path == '/health':
+            self.send_json(200, {
+                'status': 'ok' if batcher.thread.is_alive() else 'stopped',
+                'batching': batcher.mode,
+                'representation': batcher.denoiser.representation,
+                'signal_length': batcher.denoiser.signal_length,
+                'sampler': batcher.denoiser.sampler,
+                'steps': batcher.steps,
+                'shots': batcher.shots,
+                'max_batch_size': batcher.max_batch_size,
+                'max_latency': batcher.max_latency,
+                'load_time': batcher.denoiser.timings['load']
+            })
+        elif self.path == '/stats':
+            self.send_json(200, batcher.stats())
+        else:
+            self.send_json(404, {'error': 'unknown endpoint ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/denoise':
+            self.send_json(404, {'error': 'unknown endpoint ' + self.path})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            signals = json.loads(self.rfile.read(length))['signals']
+            future = self.server.batcher.submit(signals)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except RuntimeError as e:
+            self.send_json(503, {'error': str(e)})        # shutting down
+            return
+        try:
+            denoised = future.result()
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'signals': denoised.tolist(), 'latency': time.perf_counter() - start})
+
+    def log_message(self, format, *args):
+        pass        # one line per request would dominate the console under load
+
+
+def serve(batcher, host='127.0.0.1', port=8080):
+    server = ThreadingHTTPServer((host, port), DenoiseHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+if __name__ == '__main__':
+    # SERVER CONFIG
+    host = '127.0.0.1'          # localhost only
+    port = 8080
+    max_batch_size = 32         # windows per reverse diffusion run
+    max_latency = 0.05          # seconds a batch waits for more requests (dynamic)
+    batching = 'continuous'     # 'dynamic' (whole trajectories) or 'continuous' (step-level)
+    sampler = 'ddim'
+    steps = 50                  # None -> all 2000 steps
+    shots = 1
+
+    denoiser = Denoiser(sampler=sampler, max_batch_size=max_batch_size)
+    print(f"Status: Model loaded in {denoiser.timings['load']:.2f} s")
+
+    if batching == 'continuous':
+        batcher = ContinuousBatcher(denoiser, max_batch_size=max_batch_size, steps=steps, shots=shots)
+    else:
+        batcher = DynamicBatcher(denoiser, max_batch_size=max_batch_size, max_latency=max_latency, steps=steps, shots=shots)
+    server = serve(batcher, host, port)
+    print(f'Serving on http://{host}:{port} (POST /denoise, GET /health, GET /stats)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
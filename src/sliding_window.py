@@ -0,0 +1,70 @@
+import numpy as np
+import torch
+
+from embedding import EmbeddingGAF
+
+# Denoise ECG records of arbitrary length: the record is cut into overlapping
+# windows, all windows go through GaussianDiffusion as one batch and the
+# recovered diagonals are stitched back with an overlap-add crossfade.
+class SlidingWindowDenoiser:
+    def __init__(self, diffusion, window_size=128, hop_size=64, max_batch_size=32,
+                 sampler='ddpm', sampling_steps=None):
+        if hop_size < 1 or hop_size > window_size:
+            raise ValueError("hop_size must lie in [1, window_size]")
+        self.diffusion = diffusion
+        self.window_size = window_size
+        self.hop_size = hop_size
+        self.max_batch_size = max_batch_size
+        self.sampler = sampler
+        self.sampling_steps = sampling_steps
+        self.embedding_gaf = EmbeddingGAF()
+
+    def split_record(self, record):
+        # Start indices of the windows; the last window is aligned to the end of the record
+        record = np.asarray(record, dtype=np.float64).squeeze()
+        if len(record) < self.window_size:
+            # short record: pad with the last value, trimmed again when stitching
+            record = np.pad(record, (0, self.window_size - len(record)), mode='edge')
+        starts = list(range(0, len(record) - self.window_size + 1, self.hop_size))
+        if starts[-1] + self.window_size < len(record):
+            starts.append(len(record) - self.window_size)
+        windows = np.stack([record[s:s + self.window_size] for s in starts])
+        return windows, starts
+
+    def crossfade_weights(self):
+        # Linear fade in/out over the overlap; overlapping ramps sum to one
+        overlap = self.window_size - self.hop_size
+        weights = np.ones(self.window_size)
+        if overlap > 0:
+            ramp = np.arange(1, overlap + 1) / (overlap + 1)
+            weights[:overlap] = ramp
+            weights[-overlap:] = ramp[::-1]
+        return weights
+
+    def stitch_windows(self, windows, starts, length):
+        weights = self.crossfade_weights()
+        total = max(length, self.window_size)
+        signal = np.zeros(total)
+        norm = np.zeros(total)
+        for window, start in zip(windows, starts):
+            signal[start:start + self.window_size] += weights * window
+            norm[start:start + self.window_size] += weights
+        return (signal / norm)[:length]
+
+    @torch.no_grad()
+    def denoise_record(self, record):
+        record = np.asarray(record, dtype=np.float64).squeeze()
+        windows, starts = self.split_record(record)
+
+        # EMBED -> SAMPLE (one batch for the whole record)
+        device = self.diffusion.betas.device
+        gaf_SR, scale = self.embedding_gaf.ecg_to_GAF_batch(windows, device=device, return_scale=True)
+        sampled = self.diffusion.p_sample_loop_batched(gaf_SR, max_batch_size=self.max_batch_size,
+                                                       sampler=self.sampler, sampling_steps=self.sampling_steps)
+
+        # RECOVER: diagonal of the field is the rescaled window, undo the min/max rescale
+        recovered = self.embedding_gaf.GAF_to_ecg_batch(sampled, scale).cpu().numpy().astype(np.float64)
+        flat = (windows.max(axis=1) - windows.min(axis=1)) == 0
+        recovered[flat] = windows[flat]        # nothing to denoise on a constant window
+
+        return self.stitch_windows(recovered, starts, len(record))
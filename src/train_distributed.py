@@ -0,0 +1,192 @@
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+from tqdm import tqdm
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DataLoader, DistributedSampler
+
+# LOCAL
+from diffusion import GaussianDiffusion
+from unet import UNet
+from embedding import EmbeddingGAF
+from gaf_shards import GAFShardDataset, INDEX_FILE
+from datahelper import ECGSliceDataset
+from fast_training import FastTraining, Throughput
+from checkpoint import CheckpointManager
+
+# Data-parallel training on CPU cores / hosts (gloo backend), launch with torchrun:
+#
+#   One machine, 8 processes:
+#       torchrun --standalone --nproc_per_node=8 train_distributed.py
+#
+#   Hosts on a LAN (run on every host, node_rank 0..nnodes-1):
+#       torchrun --nnodes=2 --nproc_per_node=8 --node_rank=0 \
+#                --master_addr=192.168.1.10 --master_port=29500 train_distributed.py
+
+# # *************************
+# # STEP 0: PROCESS GROUP
+# # *************************
+
+dist.init_process_group(backend='gloo')
+rank = dist.get_rank()
+world_size = dist.get_world_size()
+is_main = rank == 0
+
+# Split the cores of a host between its processes
+local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+
+# Different noise / timesteps per rank, same initial weights (DDP broadcasts rank 0)
+seed = 0
+torch.manual_seed(seed + rank)
+np.random.seed(seed + rank)
+
+device = torch.device('cpu')
+if is_main:
+    print('Status: Process group with', world_size, 'processes,', torch.get_num_threads(), 'threads each')
+
+# # *************************
+# # STEP 1: MODEL
+# # *************************
+
+# Define parameters of the U-Net (denoising function)
+in_channels = 1*2
+out_channels = 1                        # Output will also be GrayScale
+inner_channels = 32                     # Depth feature maps, model complexity
+norm_groups = 32                        # Granularity of normalization, impacting convergence
+channel_mults = (1, 2, 4, 8, 8)
+attn_res = [8]
+res_blocks = 3
+dropout = 0
+with_noise_level_emb = True
+image_size = 128
+
+denoise_fn = UNet(
+    in_channel=in_channels,
+    out_channel=out_channels,
+    inner_channel=inner_channels,
+    norm_groups=norm_groups,
+    channel_mults=channel_mults,
+    attn_res=attn_res,
+    res_blocks=res_blocks,
+    dropout=dropout,
+    with_noise_level_emb=with_noise_level_emb,
+    image_size=image_size
+)
+
+config_diff = {
+    'beta_start': 1e-6,
+    'beta_end': 1e-2,
+    'num_steps': 2000,
+    'schedule': "linear"
+}
+
+model = GaussianDiffusion(
+    denoise_fn=denoise_fn,
+    image_size=(128, 128),
+    channels=1,
+    loss_type='l1',
+    conditional=True,
+    config_diff=config_diff
+).to(device)
+
+# FAST TRAINING (opt-in), see training.py
+config_fast = {
+    'enabled': False,
+    'amp_dtype': 'bfloat16',
+    'compile': True,
+    'channels_last': True
+}
+fast = FastTraining(model, device, **config_fast)
+
+# Gradients are all-reduced in buckets during backward, the noise schedule
+# buffers are constants and need no broadcast
+ddp_model = DDP(model, broadcast_buffers=False)
+
+# # *************************
+# # STEP 2: DATA (sharded per rank)
+# # *************************
+
+# Memory-mapped GAF shards (build_gaf_shards.py, run once beforehand): all processes
+# of a host share the pages through the OS page cache. The pickles are only a
+# fallback, every process then unpickles its own copy of the full slices (~1.5 GB)
+use_gaf_shards = True
+gaf_shards_dir = 'gaf_shards'
+path_clean, path_noisy = 'ardb_slices_clean.pkl', 'ardb_slices_noisy.pkl'
+num_signals = 55000
+
+if use_gaf_shards:
+    if not os.path.exists(os.path.join(gaf_shards_dir, INDEX_FILE)):
+        raise FileNotFoundError(f"No GAF shards in '{gaf_shards_dir}', run build_gaf_shards.py first "
+                                "(or set use_gaf_shards = False)")
+    train_dataset = GAFShardDataset(gaf_shards_dir, start=0, stop=num_signals, source=(path_clean, path_noisy))
+else:
+    # raw windows, embedded per batch
+    train_dataset = ECGSliceDataset(path_clean, path_noisy).subset(0, num_signals)
+
+embedding_gaf = EmbeddingGAF()
+
+batch_size = 16                     # per process, global batch = batch_size * world_size
+sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=seed)
+dataloader = DataLoader(train_dataset, batch_size=batch_size, sampler=sampler, num_workers=0)
+
+# # *************************
+# # STEP 3: TRAINING
+# # *************************
+
+optimizer = torch.optim.Adam(ddp_model.parameters(), lr=1e-4)
+num_epochs = 30
+
+# Rank 0 writes the checkpoints
+checkpoints = CheckpointManager(directory='.', keep_last=1) if is_main else None
+save_model_diff = 'diff_model_dist.pth'
+save_model_dn = 'dn_model_dist.pth'
+
+best_loss = float('inf')
+
+for epoch in range(num_epochs):
+    ddp_model.train()
+    sampler.set_epoch(epoch)            # new shuffle every epoch, same on every rank
+    total_loss = 0.0
+    throughput = Throughput()
+
+    pbar = tqdm(dataloader, desc=f"Epoch {epoch+1}/{num_epochs}", unit="batch", disable=not is_main)
+
+    for clean_batch, noisy_batch in pbar:
+        if not use_gaf_shards:
+            clean_batch = embedding_gaf.ecg_to_GAF_batch(clean_batch, device=device)
+            noisy_batch = embedding_gaf.ecg_to_GAF_batch(noisy_batch, device=device)
+
+        optimizer.zero_grad()
+
+        with fast.autocast():
+            loss = ddp_model({'HR': fast.prepare(clean_batch), 'SR': fast.prepare(noisy_batch)})
+
+        fast.backward_step(loss, optimizer)
+        throughput.update(clean_batch.shape[0])
+
+        total_loss += loss.item()
+        pbar.set_postfix({'Loss': loss.item()})
+
+    # Average loss and summed throughput over all ranks
+    stats = torch.tensor([total_loss, len(dataloader), throughput.rate()], dtype=torch.float64)
+    dist.all_reduce(stats, op=dist.ReduceOp.SUM)
+    avg_loss = (stats[0] / stats[1]).item()
+
+    if is_main:
+        print(f"Epoch [{epoch+1}/{num_epochs}], Avg Loss: {avg_loss:.4f}, Samples/sec: {stats[2].item():.1f}")
+
+        if avg_loss < best_loss:
+            best_loss = avg_loss
+            best_model_state_dict = checkpoints.snapshot(model)
+            checkpoints.save_async(best_model_state_dict, save_model_diff, group='diff')
+            checkpoints.save_async(checkpoints.sub_state_dict(best_model_state_dict), save_model_dn, group='dn')
+
+# ********************
+if is_main:
+    checkpoints.close()
+    print('Status: Finished Training, best loss', best_loss)
+
+dist.barrier()
+dist.destroy_process_group()
@@ -1,15 +1,17 @@
 import torch
-import pickle
 from tqdm import tqdm
 from torch.utils.data import DataLoader, Dataset
 from torch import device
-from sklearn.model_selection import train_test_split
 from datetime import datetime
 
 # LOCAL
 from diffusion import GaussianDiffusion
 from unet import UNet
 from embedding import EmbeddingGAF
+from gaf_shards import GAFShardDataset
+from datahelper import ECGSliceDataset
+from fast_training import FastTraining, Throughput
+from checkpoint import CheckpointManager
 
 # DEVICE
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -82,6 +84,15 @@ denoise_fn.to(device)
 model.to(device)
 print('Status: Model loaded on device', device)
 
+# FAST TRAINING (opt-in): autocast, gradient scaling, torch.compile, channels-last
+config_fast = {
+    'enabled': False,
+    'amp_dtype': 'bfloat16',        # 'bfloat16' (CPU/CUDA) or 'float16' (CUDA)
+    'compile': True,
+    'channels_last': True
+}
+fast = FastTraining(model, device, **config_fast)
+
 # # **************************************
 # # STEP 2: DATA LOADING (SMALL)
 # # **************************************
@@ -96,16 +107,48 @@ class mijnDataset(Dataset):
         return len(self.clean_signals)
     
     def __getitem__(self, index):
-        clean_signal = torch.tensor(self.clean_signals[index], dtype=torch.float32)
-        noisy_signal = torch.tensor(self.noisy_signals[index], dtype=torch.float32)
+        # no copy for data that already is a float32 tensor
+        clean_signal = torch.as_tensor(self.clean_signals[index], dtype=torch.float32)
+        noisy_signal = torch.as_tensor(self.noisy_signals[index], dtype=torch.float32)
         return clean_signal, noisy_signal
 
 # EMBEDDING 
 embedding_gaf = EmbeddingGAF()
 
+# DATA SOURCE: precomputed GAF shards (build_gaf_shards.py) or pickles embedded at startup
+use_gaf_shards = False
+gaf_shards_dir = 'gaf_shards_MA'        # build_gaf_shards.py with the MA slices below
+path_clean, path_noisy = 'ardb_slices_clean_MA.pkl', 'ardb_slices_noisy_MA_snr3.pkl'
+
+# LOAD SLICES (once, every subset is a view)
+if not use_gaf_shards:
+    slices = ECGSliceDataset(path_clean, path_noisy)
+
+# CHECKPOINTS (written in the background, last 3 per model of this job kept)
+checkpoints = CheckpointManager(directory='.', keep_last=3)
+
+# OPTIMIZER (kept across subsets, its moments are part of the training state)
+optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+
+# RESUME: one checkpoint carries model, optimizer, subset offset, epoch, RNG states
+# and best loss; it is rewritten after every epoch, a killed job continues from there.
+# It is removed when the job finishes, fresh_start = True ignores a leftover one
+fresh_start = False
+resume_path = 'training_state_MA.pth'
+resume_state = None if fresh_start else checkpoints.load_training_state(resume_path)
+start_subset, start_epoch = 0, 0
+if resume_state is not None:
+    model.load_state_dict(resume_state['model'])
+    optimizer.load_state_dict(resume_state['optimizer'])
+    if resume_state['scaler'] is not None:
+        fast.scaler.load_state_dict(resume_state['scaler'])
+    start_subset, start_epoch = resume_state['subset_offset'], resume_state['epoch']
+    checkpoints.restore_written(resume_state)
+    print('Status: Resuming at subset', start_subset, 'epoch', start_epoch)
+
 # SUBSETS
 subset_size = 2500
-for i in range(0,55000, subset_size):
+for i in range(start_subset, 55000, subset_size):
     
     # Device (return to CUDA after inference if available)
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -119,55 +162,23 @@ for i in range(0,55000, subset_size):
     save_model_diff = 'diff_model_MA' + str(formatted_time) + '.pth'
     save_model_dn = 'dn_model_MA' + str(formatted_time) + '.pth'
 
-    # LOAD SUBSET SLICES
-    with open('ardb_slices_clean_MA.pkl', 'rb') as f:
-        clean_signals = pickle.load(f)
-    clean_signals_subset = clean_signals[i:i+subset_size]
-    
-    gaf_HR = embedding_gaf.ecg_to_GAF(clean_signals[57000][:128])
-    
-    del clean_signals       # REMOVE FROM MEMORY
-
-    with open('ardb_slices_noisy_MA_snr3.pkl', 'rb') as f:
-        noisy_signals = pickle.load(f)
+    if use_gaf_shards:
+        # Page the subset in from the memory-mapped shards (embedded offline)
+        train_dataset = GAFShardDataset(gaf_shards_dir, start=i, stop=i+subset_size, source=(path_clean, path_noisy))
 
-    gaf_SR = embedding_gaf.ecg_to_GAF(noisy_signals[57000][:128])
+    else:
+        # SUBSET (view on the slices loaded once above)
+        clean_signals_subset, noisy_signals_subset = slices.subset(i, i+subset_size).arrays()
 
-    noisy_signals_subset= noisy_signals[i:i+subset_size]
+        # # **************************************
+        # # STEP 1b: EMBEDD THE DATA PUSH TO CUDA
+        # # **************************************
 
-    del noisy_signals       # REMOVE FROM MEMORY
+        # Embed the whole subset at once on the device, (B, 1, 128, 128)
+        embedded_clean_data = embedding_gaf.ecg_to_GAF_batch(clean_signals_subset, device=device)
+        embedded_noisy_data = embedding_gaf.ecg_to_GAF_batch(noisy_signals_subset, device=device)
 
-    #############################################
-    ############################################
-
-    dataset = mijnDataset(clean_signals_subset, noisy_signals_subset)
-
-    # # **************************************
-    # # STEP 1b: EMBEDD THE DATA PUSH TO CUDA
-    # # **************************************
-
-    # Initialize lists to store embedded clean and noisy batches
-    embedded_clean_batches = []
-    embedded_noisy_batches = []
-
-    # Iterate through the dataset to embed each sample
-    for clean_signal, noisy_signal in dataset:
-        clean_gaf = embedding_gaf.ecg_to_GAF(clean_signal.numpy())
-        noisy_gaf = embedding_gaf.ecg_to_GAF(noisy_signal.numpy())
-        embedded_clean_batches.append(clean_gaf)
-        embedded_noisy_batches.append(noisy_gaf)
-
-    # Convert the lists to torch tensors
-    embedded_clean_data = torch.cat(embedded_clean_batches)
-    embedded_noisy_data = torch.cat(embedded_noisy_batches)
-
-    # Add a channel dimension to the tensors
-    embedded_clean_data = embedded_clean_data.unsqueeze(1)
-    embedded_noisy_data = embedded_noisy_data.unsqueeze(1)
-
-    # Transfer the data to the device if necessary
-    embedded_clean_data = embedded_clean_data.to(device)
-    embedded_noisy_data = embedded_noisy_data.to(device)
+        train_dataset = mijnDataset(embedded_clean_data, embedded_noisy_data)
 
 
     # # **************************************
@@ -179,49 +190,55 @@ for i in range(0,55000, subset_size):
     num_workers = 0  # Set according to your system capabilities
     shuffle = True
     # Use the embedded data for training
-    dataloader = DataLoader(mijnDataset(embedded_clean_data, embedded_noisy_data), 
+    dataloader = DataLoader(train_dataset, 
                             batch_size=batch_size, num_workers=num_workers, shuffle=shuffle)
 
-    # Define your optimizer
-    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
-
     # Set up your training loop
     num_epochs = 30
     
     # Initialize best_loss and best_model_state_dict
     best_loss = float('inf')
     best_model_state_dict = None
+    first_epoch = 0
+
+    # Resumed subset: continue after the last finished epoch
+    if resume_state is not None and i == start_subset:
+        best_loss = resume_state['best_loss']
+        best_model_state_dict = resume_state['best_model']
+        first_epoch = start_epoch
+        checkpoints.restore_rng_state(resume_state['rng'])
+        resume_state = None
 
     # TQDM
-    for epoch in range(num_epochs):
+    for epoch in range(first_epoch, num_epochs):
         model.train()
         total_loss = 0.0
+        throughput = Throughput()
 
         # Initialize tqdm for the epoch
         pbar = tqdm(dataloader, desc=f"Epoch {epoch+1}/{num_epochs}", unit="batch")
 
         for batch_idx, (clean_batch, noisy_batch) in enumerate(pbar):
             # Transfer batches to device if necessary (not needed if you've already done it above)
-            clean_batch = clean_batch
-            noisy_batch = noisy_batch
+            clean_batch = clean_batch.to(device, non_blocking=True)
+            noisy_batch = noisy_batch.to(device, non_blocking=True)
 
             # Zero the gradients
             optimizer.zero_grad()
 
             # Forward pass
-            loss = model({'HR': clean_batch, 'SR': noisy_batch})  # Assuming input format is {'HR': clean, 'SR': noisy}
+            with fast.autocast():
+                loss = model({'HR': fast.prepare(clean_batch), 'SR': fast.prepare(noisy_batch)})  # Assuming input format is {'HR': clean, 'SR': noisy}
 
-            # Backward pass
-            loss.backward()
-
-            # Update the parameters
-            optimizer.step()
+            # Backward pass, update the parameters
+            fast.backward_step(loss, optimizer)
+            throughput.update(clean_batch.shape[0])
 
             # Accumulate the loss
             total_loss += loss.item()
         	
             # Update progress bar description with current loss
-            pbar.set_postfix({'Loss': loss.item()})
+            pbar.set_postfix({'Loss': loss.item(), 'samples/s': f"{throughput.rate():.1f}"})
 
 
         # Calculate average loss for the epoch
@@ -230,17 +247,25 @@ for i in range(0,55000, subset_size):
         # Check if current model is the best so far
         if avg_loss < best_loss:
             best_loss = avg_loss
-            best_model_state_dict = model.state_dict()
+            best_model_state_dict = checkpoints.snapshot(model)     # copy, not a reference to the live weights
 
         # Print progress
-        print(f"Epoch [{epoch+1}/{num_epochs}], Avg Loss: {avg_loss:.4f}")
+        print(f"Epoch [{epoch+1}/{num_epochs}], Avg Loss: {avg_loss:.4f}, Samples/sec: {throughput.rate():.1f}")
+
+        # Training state after this epoch
+        checkpoints.save_async(checkpoints.training_state(model, optimizer, fast.scaler,
+                                                          subset_offset=i, epoch=epoch+1,
+                                                          best_loss=best_loss, best_model=best_model_state_dict),
+                               resume_path)
 
     # ********************
     # SAVE 
 
-    print('Status: Saving Models')
-    torch.save(model.state_dict(), save_model_diff)                 # difffusion model
-    torch.save(model.denoise_fn.state_dict(), save_model_dn)        # denoising model
+    print('Status: Saving Models (best epoch)')
+    checkpoints.save_async(best_model_state_dict, save_model_diff, group='diff')                                   # difffusion model
+    checkpoints.save_async(checkpoints.sub_state_dict(best_model_state_dict), save_model_dn, group='dn')           # denoising model
 
 # ********************
-print('Status: Finished Training at time ', + str(formatted_time))
+checkpoints.close()
+checkpoints.clear_training_state(resume_path)
+print('Status: Finished Training at time', str(formatted_time))
@@ -0,0 +1,225 @@
+import math
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from unet import PositionalEncoding, FeatureWiseAffine, Swish, exists, default
+
+# Conv1d variant of UNet working directly on the (rescaled) waveform (B, C, N):
+# same ResnetBlocWithAttn / FeatureWiseAffine structure and noise level embedding,
+# cost linear in the window length instead of the N x N GAF field
+
+
+class Upsample1D(nn.Module):
+    def __init__(self, dim):
+        super().__init__()
+        self.up = nn.Upsample(scale_factor=2, mode="nearest")
+
+        self.conv = nn.Conv1d(dim, dim, 3, padding=1)
+
+    def forward(self, x):
+        return self.conv(self.up(x))
+
+class Downsample1D(nn.Module):
+    def __init__(self, dim):
+        super().__init__()
+        self.conv = nn.Conv1d(dim, dim, 3, 2, 1)
+
+    def forward(self, x):
+        return self.conv(x)
+
+
+# building block modules
+
+
+class Block1D(nn.Module):
+    def __init__(self, dim, dim_out, groups=32, dropout=0):
+        super().__init__()
+        self.block = nn.Sequential(
+            nn.GroupNorm(groups, dim),
+            Swish(),
+            nn.Dropout(dropout) if dropout != 0 else nn.Identity(),
+            nn.Conv1d(dim, dim_out, 3, padding=1)
+        )
+
+    def forward(self, x):
+        return self.block(x)
+
+
+class ResnetBlock1D(nn.Module):
+    def __init__(self, dim, dim_out, noise_level_emb_dim=None, dropout=0, use_affine_level=False, norm_groups=32):
+        super().__init__()
+        self.noise_func = FeatureWiseAffine(
+            noise_level_emb_dim, dim_out, use_affine_level, dims=1)
+
+        self.block1 = Block1D(dim, dim_out, groups=norm_groups)
+        self.block2 = Block1D(dim_out, dim_out, groups=norm_groups, dropout=dropout)
+        self.res_conv = nn.Conv1d(
+            dim, dim_out, 1) if dim != dim_out else nn.Identity()
+
+    def forward(self, x, time_emb, cache_index=None):
+        h = self.block1(x)
+        h = self.noise_func(h, time_emb, cache_index)
+        h = self.block2(h)
+        return h + self.res_conv(x)
+
+
+class SelfAttention1D(nn.Module):
+    def __init__(self, in_channel, n_head=1, norm_groups=32):
+        super().__init__()
+
+        self.n_head = n_head
+
+        self.norm = nn.GroupNorm(norm_groups, in_channel)
+        self.qkv = nn.Conv1d(in_channel, in_channel * 3, 1, bias=False)
+        self.out = nn.Conv1d(in_channel, in_channel, 1)
+
+    def forward(self, input):
+        batch, channel, length = input.shape
+        n_head = self.n_head
+        head_dim = channel // n_head
+
+        norm = self.norm(input)
+        qkv = self.qkv(norm).view(batch, n_head, head_dim * 3, length)
+        query, key, value = (t.transpose(-1, -2) for t in qkv.chunk(3, dim=2))  # bnld
+
+        # same 1/sqrt(channel) scaling as the 2D SelfAttention
+        query = query * (math.sqrt(head_dim) / math.sqrt(channel))
+        out = F.scaled_dot_product_attention(query, key, value)
+        out = self.out(out.transpose(-1, -2).reshape(batch, channel, length))
+
+        return out + input
+
+
+class ResnetBlocWithAttn1D(nn.Module):
+    def __init__(self, dim, dim_out, *, noise_level_emb_dim=None, norm_groups=32, dropout=0, with_attn=False):
+        super().__init__()
+        self.with_attn = with_attn
+        self.res_block = ResnetBlock1D(
+            dim, dim_out, noise_level_emb_dim, norm_groups=norm_groups, dropout=dropout)
+        if with_attn:
+            self.attn = SelfAttention1D(dim_out, norm_groups=norm_groups)
+
+    def forward(self, x, time_emb, cache_index=None):
+        x = self.res_block(x, time_emb, cache_index)
+        if(self.with_attn):
+            x = self.attn(x)
+        return x
+
+
+class UNet1D(nn.Module):
+    def __init__(
+        self,
+        in_channel=2,
+        out_channel=1,
+        inner_channel=32,
+        norm_groups=32,
+        channel_mults=(1, 2, 4, 8, 8),
+        attn_res = [8],
+        res_blocks=3,
+        dropout=0,
+        with_noise_level_emb=True,
+        signal_length=128
+    ):
+        super().__init__()
+
+        if with_noise_level_emb:
+            noise_level_channel = inner_channel
+            self.noise_level_mlp = nn.Sequential(
+                PositionalEncoding(inner_channel),
+                nn.Linear(inner_channel, inner_channel * 4),
+                Swish(),
+                nn.Linear(inner_channel * 4, inner_channel)
+            )
+        else:
+            noise_level_channel = None
+            self.noise_level_mlp = None
+
+        num_mults = len(channel_mults)
+        pre_channel = inner_channel
+        feat_channels = [pre_channel]
+        now_res = signal_length
+        downs = [nn.Conv1d(in_channel, inner_channel,
+                           kernel_size=3, padding=1)]
+        for ind in range(num_mults):
+            is_last = (ind == num_mults - 1)
+            use_attn = (now_res in attn_res)
+            channel_mult = inner_channel * channel_mults[ind]
+            for _ in range(0, res_blocks):
+                downs.append(ResnetBlocWithAttn1D(
+                    pre_channel, channel_mult, noise_level_emb_dim=noise_level_channel, norm_groups=norm_groups, dropout=dropout, with_attn=use_attn))
+                feat_channels.append(channel_mult)
+                pre_channel = channel_mult
+            if not is_last:
+                downs.append(Downsample1D(pre_channel))
+                feat_channels.append(pre_channel)
+                now_res = now_res//2
+        self.downs = nn.ModuleList(downs)
+
+        self.mid = nn.ModuleList([
+            ResnetBlocWithAttn1D(pre_channel, pre_channel, noise_level_emb_dim=noise_level_channel, norm_groups=norm_groups,
+                                 dropout=dropout, with_attn=True),
+            ResnetBlocWithAttn1D(pre_channel, pre_channel, noise_level_emb_dim=noise_level_channel, norm_groups=norm_groups,
+                                 dropout=dropout, with_attn=False)
+        ])
+
+        ups = []
+        for ind in reversed(range(num_mults)):
+            is_last = (ind < 1)
+            use_attn = (now_res in attn_res)
+            channel_mult = inner_channel * channel_mults[ind]
+            for _ in range(0, res_blocks+1):
+                ups.append(ResnetBlocWithAttn1D(
+                    pre_channel+feat_channels.pop(), channel_mult, noise_level_emb_dim=noise_level_channel, norm_groups=norm_groups,
+                        dropout=dropout, with_attn=use_attn))
+                pre_channel = channel_mult
+            if not is_last:
+                ups.append(Upsample1D(pre_channel))
+                now_res = now_res*2
+
+        self.ups = nn.ModuleList(ups)
+
+        self.final_conv = Block1D(pre_channel, default(out_channel, in_channel), groups=norm_groups)
+
+    # ********************************
+    # Inference cache of noise-level embeddings (see UNet.build_noise_cache)
+    @torch.no_grad()
+    def build_noise_cache(self, noise_levels):
+        t = self.noise_level_mlp(noise_levels)
+        for module in self.modules():
+            if isinstance(module, FeatureWiseAffine):
+                module.build_cache(t)
+
+    def clear_noise_cache(self):
+        for module in self.modules():
+            if isinstance(module, FeatureWiseAffine):
+                module.cached_noise = None
+
+    def forward(self, x, time, cache_index=None):
+        if cache_index is not None:
+            t = None
+        else:
+            t = self.noise_level_mlp(time) if exists(
+                self.noise_level_mlp) else None
+
+        feats = []
+        for layer in self.downs:
+            if isinstance(layer, ResnetBlocWithAttn1D):
+                x = layer(x, t, cache_index)
+            else:
+                x = layer(x)
+            feats.append(x)
+
+        for layer in self.mid:
+            if isinstance(layer, ResnetBlocWithAttn1D):
+                x = layer(x, t, cache_index)
+            else:
+                x = layer(x)
+
+        for layer in self.ups:
+            if isinstance(layer, ResnetBlocWithAttn1D):
+                x = layer(torch.cat((x, feats.pop()), dim=1), t, cache_index)
+            else:
+                x = layer(x)
+
+        return self.final_conv(x)